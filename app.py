@@ -2,297 +2,270 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import os
+import hmac
+import tempfile
+import click
+from flask import Flask, Blueprint, current_app, render_template, request, flash, redirect, url_for, abort, Response, send_file, stream_with_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from flask_migrate import Migrate
-from sqlalchemy.ext.hybrid import hybrid_property
+from forms import ShowForm, VenueForm, ArtistForm
+from models import db, Venue, Artist, Show, update_versioned, compact_deleted_venues
+import export
+import geo
+import rows
+import ratelimit
+import search
+from tasks import TaskQueue
+from assets import Assets
+from thumbnails import Thumbnails
+from ratelimit import RateLimiter
+from metrics import Metrics
+from logs import RequestLog
 from datetime import datetime
+from functools import lru_cache
+from werkzeug.local import LocalProxy
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-# TODO: connect to a local postgresql database
+#   Every app gets its own extensions, the controllers reach the ones of the app handling the request
+tasks = LocalProxy(lambda: current_app.extensions['tasks'])
+search_cache = LocalProxy(lambda: current_app.extensions['search_cache'])
+
+main = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config='config'):
+  app = Flask(__name__)
+  app.config.from_object(config)
+  Moment(app)
+  db.init_app(app)
+  task_queue = TaskQueue(app)
+  Assets(app)
+  Thumbnails(app)
+  limiter = RateLimiter(app)
+  cache = search.SearchCache(app)
+  metrics = Metrics(app)
+  RequestLog(app)
+  for func in (geocode_venue, compact_venues, notify_listing):
+    task_queue.task()(func)
+  init_metrics(metrics, task_queue, limiter, cache)
+  app.jinja_env.filters['datetime'] = format_datetime
+  app.register_blueprint(main)
+  # alembic is only needed by `flask db ...`, web workers never import it
+  if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    Migrate(app, db)
+  return app
 
 #----------------------------------------------------------------------------#
-# Models.
+# Filters.
 #----------------------------------------------------------------------------#
 
-class Venue(db.Model):
-    __tablename__ = 'Venue'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    address = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-
-    genres = db.Column(db.String())
-    website = db.Column(db.String(120))
-    seeking_talent = db.Column(db.Boolean)
-    seeking_description = db.Column(db.String(500))
-
-    @hybrid_property
-    def format(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'city': self.city,
-            'state': self.state,
-            'phone': self.phone,
-            'address': self.address,
-            'image_link': self.image_link,
-            'facebook_link': self.facebook_link,
-            'genres': self.genres.split(','),
-            'website': self.website,
-            'seeking_talent': self.seeking_talent,
-            'seeking_description': self.seeking_description,
-            'num_upcoming_shows': self.get_upcoming_shows_count()
-        }
-
-    @hybrid_property
-    def format_short(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'num_upcoming_shows': self.get_upcoming_shows_count()
-        }
-
-
-    #   Using hybrid_property to be able call these function in the controllers below
-    @hybrid_property
-    def format_full(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'genres': self.genres.split(','),
-            'address': self.address,
-            'city': self.city,
-            'state': self.state,
-            'phone': self.phone,
-            'website': self.website,
-            'facebook_link': self.facebook_link,
-            'seeking_talent': self.seeking_talent,
-            'seeking_description': self.seeking_description,
-            'image_link': self.image_link,
-            'past_shows': [show.format for show in self.get_past_shows()],
-            'upcoming_shows': [show.format for show in self.get_upcoming_shows()],
-            'past_shows_count': self.get_past_shows_count(),
-            'upcoming_shows_count': self.get_upcoming_shows_count()
-        }
-
-    #   This function will call upon `get_venues_in_area` as a helper function to ease formatting venues by cities and states
-    @hybrid_property
-    def format_by_area(self):
-        return {
-            'city': self.city,
-            'state': self.state,
-            'venues': [venue.format_short for venue in self.get_venues_in_area()]
-        }
-
-    #   A helper function when I am trying to format correctly the venues so they display per city and state
-    def get_venues_in_area(self):
-        return Venue.query.filter(Venue.city == self.city, Venue.state == self.state).all()
-
-    def get_past_shows(self):
-        return Show.query.filter(Show.start_time < datetime.now(), Show.venue_id == self.id).all()
-
-    def get_upcoming_shows(self):
-        return Show.query.filter(Show.start_time > datetime.now(), Show.venue_id == self.id).all()
-
-    def get_past_shows_count(self):
-        return len(Show.query.filter(Show.start_time < datetime.now(), Show.venue_id == self.id).all())
-
-    def get_upcoming_shows_count(self):
-        return len(Show.query.filter(Show.start_time > datetime.now(), Show.venue_id == self.id).all())
-
-
-
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-class Artist(db.Model):
-    __tablename__ = 'Artist'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-
-    website = db.Column(db.String(120))
-    seeking_venue = db.Column(db.Boolean)
-    seeking_description = db.Column(db.String(500))
-
-    @hybrid_property
-    def format(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'city': self.city,
-            'state': self.state,
-            'phone': self.phone,
-            'image_link': self.image_link,
-            'facebook_link': self.facebook_link,
-            'genres': self.genres.split(','),
-            'website': self.website,
-            'seeking_venue': self.seeking_venue,
-            'seeking_description': self.seeking_description,
-            'num_upcoming_shows': self.get_upcoming_shows_count()
-        }
-
-    @hybrid_property
-    def format_short(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'num_upcoming_shows': self.get_upcoming_shows_count()
-        }
-
-    @hybrid_property
-    def format_full(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'genres': self.genres.split(','),
-            'city': self.city,
-            'state': self.state,
-            'phone': self.phone,
-            'website': self.website,
-            'facebook_link': self.facebook_link,
-            'seeking_venue': self.seeking_venue,
-            'seeking_description': self.seeking_description,
-            'image_link': self.image_link,
-            'past_shows': [show.format for show in self.get_past_shows()],
-            'upcoming_shows': [show.format for show in self.get_upcoming_shows()],
-            'past_shows_count': self.get_past_shows_count(),
-            'upcoming_shows_count': self.get_upcoming_shows_count()
-        }
-
-    def get_past_shows(self):
-        return Show.query.filter(Show.start_time < datetime.now(), Show.artist_id == self.id).all()
-
-    def get_upcoming_shows(self):
-        return Show.query.filter(Show.start_time > datetime.now(), Show.artist_id == self.id).all()
-
-    def get_past_shows_count(self):
-        return len(Show.query.filter(Show.start_time < datetime.now(), Show.artist_id == self.id).all())
-
-    def get_upcoming_shows_count(self):
-        return len(Show.query.filter(Show.start_time > datetime.now(), Show.artist_id == self.id).all())
-
-
-class Show(db.Model):
-    __tablename__ = 'Show'
-
-    id = db.Column(db.Integer, primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    start_time = db.Column(db.DateTime, nullable=False)
-
-    @hybrid_property
-    def format(self):
-        return {
-            'id': self.id,
-            'venue_id': self.venue_id,
-            'venue_name': self.get_venue_name(),
-            'venue_image_link': self.get_venue_image(),
-            'artist_id': self.artist_id,
-            'artist_name': self.get_artist_name(),
-            'artist_image_link': self.get_artist_image(),
-            'start_time': self.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-        }
-
-    def get_venue_name(self):
-        venue = Venue.query.get(self.venue_id)
-        return venue.name
-
-    def get_artist_name(self):
-        artist = Artist.query.get(self.artist_id)
-        return artist.name
-
-    def get_artist_image(self):
-        artist = Artist.query.get(self.artist_id)
-        return artist.image_link
-
-    def get_venue_image(self):
-        venue = Venue.query.get(self.venue_id)
-        return venue.image_link
-
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+#   Parsing a Babel pattern and loading its locale is most of the cost of a call, so both are kept around.
+#   Babel itself is only imported the first time the filter runs
+@lru_cache(maxsize=64)
+def _compile_datetime_format(format, locale):
+  import babel.dates
+  locale = babel.Locale.parse(locale)
+  if format in ('short', 'medium', 'long', 'full'):
+    # Babel's named formats are a date and a time pattern of the locale, joined by its datetime format
+    return (babel.dates.get_datetime_format(format, locale).replace("'", ""),
+            babel.dates.parse_pattern(babel.dates.get_date_format(format, locale).pattern),
+            babel.dates.parse_pattern(babel.dates.get_time_format(format, locale).pattern),
+            locale)
+  return None, babel.dates.parse_pattern(format), None, locale
+
+def format_datetime(value, format='medium', locale='en'):
+  # accepts datetimes as they come out of the db, strings are still parsed for older callers
+  if not isinstance(value, datetime):
+    import dateutil.parser
+    value = dateutil.parser.parse(value)
+  joined, date_pattern, time_pattern, locale = _compile_datetime_format(DATETIME_FORMATS.get(format, format), locale)
+  if time_pattern is None:
+    return date_pattern.apply(value, locale)
+  return joined.replace('{0}', time_pattern.apply(value, locale)).replace('{1}', date_pattern.apply(value, locale))
 
 #----------------------------------------------------------------------------#
-# Filters.
+# Tasks.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+def geocode_venue(venue_id):
+  venue = Venue.active().filter(Venue.id == venue_id).first()
+  if venue is None:
+    return
+  venue.geocode()
+  db.session.commit()
+
+def compact_venues():
+  venues, shows = compact_deleted_venues(current_app.config.get('VENUE_COMPACT_BATCH_SIZE', 1000))
+  if venues:
+    current_app.logger.info('Removed %s deleted venues and %s of their shows', venues, shows)
+
+def notify_listing(kind, entity_id, action):
+  current_app.logger.info('%s %s was %s', kind, entity_id, action)
+
+#   Search cache and task upkeep once a change is committed. It runs outside the commit's
+#   try/except: the change went through either way, so a failure here is logged, not flashed
+def after_commit(invalidate=None, jobs=()):
+  if invalidate is not None:
+    try:
+      search_cache.invalidate(invalidate)
+    except Exception:
+      current_app.logger.exception('Could not invalidate the %s search cache', invalidate)
+  for job in jobs:
+    try:
+      tasks.enqueue(*job)
+    except Exception:
+      current_app.logger.exception('Could not enqueue %s%r', job[0], tuple(job[1:]))
+
+#----------------------------------------------------------------------------#
+# Metrics.
+#----------------------------------------------------------------------------#
 
-app.jinja_env.filters['datetime'] = format_datetime
+#   Read when /metrics is scraped (and before every multi-process snapshot)
+#   The cache hit ratio is sum(rate(..._lookups_total{result="hit"})) / sum(rate(..._lookups_total)),
+#   a ratio gauge per worker couldn't be added up across workers
+def init_metrics(metrics, tasks, limiter, search_cache):
+  search_cache_lookups = metrics.counter('fyyur_search_cache_lookups_total', 'Search cache lookups.', ('result',))
+  search_cache_entries = metrics.gauge('fyyur_search_cache_entries', 'Entries in the search cache.')
+  task_runs = metrics.counter('fyyur_tasks_total', 'Background task events.', ('task', 'event'))
+  task_seconds = metrics.counter('fyyur_task_seconds_total', 'Time spent running background tasks.', ('task',))
+  ratelimit_requests = metrics.counter('fyyur_ratelimit_requests_total', 'Rate limited requests.', ('limit', 'result'))
+  pool_connections = metrics.gauge('fyyur_db_pool_connections', 'Database connections in the pool.', ('state',))
+
+  @metrics.collector
+  def collect_search_cache():
+    stats = search_cache.stats()
+    search_cache_lookups.set(stats['hits'], result='hit')
+    search_cache_lookups.set(stats['misses'], result='miss')
+    search_cache_entries.set(stats['entries'])
+
+  @metrics.collector
+  def collect_tasks():
+    for name, counts in tasks.stats().items():
+      for event in ('enqueued', 'succeeded', 'retried', 'failed'):
+        task_runs.set(counts.get(event, 0), task=name, event=event)
+      task_seconds.set(counts.get('seconds', 0), task=name)
+
+  @metrics.collector
+  def collect_ratelimit():
+    for name, counts in limiter.stats().items():
+      for result in ('allowed', 'throttled'):
+        ratelimit_requests.set(counts.get(result, 0), limit=name, result=result)
+
+  @metrics.collector
+  def collect_pool():
+    pool = db.engine.pool
+    # only QueuePool keeps these numbers, NullPool and friends have nothing to report
+    if hasattr(pool, 'checkedout'):
+      pool_connections.set(pool.size(), state='size')
+      pool_connections.set(pool.checkedin(), state='idle')
+      pool_connections.set(pool.checkedout(), state='in_use')
+      pool_connections.set(max(pool.overflow(), 0), state='overflow')
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@main.route('/')
 def index():
   return render_template('pages/home.html')
 
 
+#  Search
+#  ----------------------------------------------------------------
+
+#   Very short terms match most of the table, they are turned away before reaching the database.
+#   Only letters and digits count, punctuation isn't searched for
+def search_term_allowed(search_string):
+  min_length = current_app.config.get('SEARCH_MIN_TERM_LENGTH', 0)
+  if len(''.join(search.words(search_string))) < min_length:
+    flash('Please search for at least {} letters or digits.'.format(min_length))
+    return False
+  return True
+
+@main.route('/search', methods=['GET', 'POST'])
+@ratelimit.limit('search')
+def search_all():
+  # one search box for venues and artists, hits from both ranked together
+  search_string = request.values.get('search_term', '')
+  hits = []
+  if search_term_allowed(search_string):
+    for kind, model in (('venue', Venue), ('artist', Artist)):
+      ranked = search_cache.search(kind, model, search_string)
+      ranks = dict(ranked)
+      for record in rows.rows_by_id(model, [id for id, rank in ranked]):
+        hits.append(dict(record.as_dict(), type=kind, rank=ranks[record.id]))
+  hits.sort(key=lambda hit: hit['rank'], reverse=True)
+  response = {
+    "count": len(hits),
+    "data": hits
+  }
+  return render_template('pages/search.html', results=response, search_term=search_string)
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@main.route('/venues')
 def venues():
   # TODO: replace with real venues data.
-  # Query to capture Lists of venues in each area
-  venues_by_area = Venue.query.distinct(Venue.city, Venue.state).all()
-  # Loop through each area to format correctly for display
-  data = [venue.format_by_area for venue in venues_by_area]
+  # One projected query for every venue and its upcoming show count, grouped per city and state
+  data = rows.venue_areas()
   return render_template('pages/venues.html', areas=data);
 
-@app.route('/venues/search', methods=['POST'])
+@main.route('/venues/search', methods=['POST'])
+@ratelimit.limit('search')
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # matches name, city, state, genres and description through the full text index
   search_string = request.form.get('search_term', None)
-  venues = Venue.query.filter(Venue.name.ilike("%{}%".format(search_string))).all()
+  venues = []
+  if search_term_allowed(search_string):
+    # ids come from the search cache when the term was searched recently, the rows from one batched query
+    ranked = search_cache.search('venue', Venue, search_string)
+    venues = rows.rows_by_id(Venue, [id for id, rank in ranked])
   response = {
     "count": len(venues),
-    "data": [venue.format_short for venue in venues]
+    "data": venues
   }
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
+@main.route('/venues/nearby')
+def nearby_venues():
+  # venues within `km` of either an explicit lat/lng or a known city/state
+  km = request.args.get('km', 25, type=float)
+  lat = request.args.get('lat', type=float)
+  lng = request.args.get('lng', type=float)
+  if lat is None or lng is None:
+    point = geo.geocode(request.args.get('city'), request.args.get('state'))
+    if point is None:
+      flash('An error occurred. Location could not be found!')
+      return render_template('pages/home.html')
+    lat, lng = point
+  distances = dict(Venue.nearby(lat, lng, km))
+  data = []
+  for venue in rows.rows_by_id(Venue, list(distances)):
+    result = venue.as_dict()
+    result['distance_km'] = round(distances[venue.id], 1)
+    data.append(result)
+  response = {
+    "count": len(data),
+    "data": data
+  }
+  return render_template('pages/search_venues.html', results=response, search_term='')
+
+@main.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
 
-  venue = Venue.query.get(venue_id)
+  venue = Venue.active().filter(Venue.id == venue_id).first()
   if venue is None:
       flash('An error occurred. Venue does not exist!')
       return render_template('pages/home.html')
@@ -302,16 +275,17 @@ def show_venue(venue_id):
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
 
+  committed = False
   try:
     new_data = VenueForm(request.form)
     venue = Venue(name=new_data.name.data,
@@ -323,7 +297,10 @@ def create_venue_submission():
         facebook_link=new_data.facebook_link.data,
     )
     db.session.add(venue)
+    db.session.flush()
+    venue_id = venue.id
     db.session.commit()
+    committed = True
     # on successful db insert, flash success
     flash('Venue ' + new_data.name.data + ' was successfully listed!')
   except:
@@ -332,46 +309,56 @@ def create_venue_submission():
     flash('An error occurred. Venue ' + new_data.name.data + ' could not be listed.')
   finally:
     db.session.close()
+  if committed:
+    after_commit('venue', [('geocode_venue', venue_id), ('notify_listing', 'Venue', venue_id, 'listed')])
 
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  committed = False
   try:
-      Venue.query.filter(Venue.id == venue_id).delete()
+      # hidden right away, the row and its shows are removed by the compact_venues task
+      Venue.active().filter(Venue.id == venue_id).update({'deleted_at': datetime.utcnow()}, synchronize_session=False)
       db.session.commit()
+      committed = True
       flash('Venue number ' + venue_id + ' was successfully deleted')
   except:
       db.session.rollback()
       flash('An error occurred! Venue number ' + venue_id + ' was not deleted')
   finally:
       db.session.close()
+  if committed:
+      after_commit('venue', [('compact_venues',)])
   return render_template('pages/home.html')
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
 def artists():
   # TODO: replace with real data returned from querying the database
 
-  artists = Artist.query.all()
-  data = [artist.format_short for artist in artists]
+  data = rows.artist_rows()
   return render_template('pages/artists.html', artists=data)
 
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/search', methods=['POST'])
+@ratelimit.limit('search')
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # matches name, city, state, genres and description through the full text index
   search_string = request.form.get('search_term', None)
-  artists = Artist.query.filter(Artist.name.ilike("%{}%".format(search_string))).all()
+  artists = []
+  if search_term_allowed(search_string):
+    ranked = search_cache.search('artist', Artist, search_string)
+    artists = rows.rows_by_id(Artist, [id for id, rank in ranked])
   response = {
     "count": len(artists),
-    "data": [artist.format_short for artist in artists]
+    "data": artists
   }
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/artists/<int:artist_id>')
+@main.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
@@ -385,7 +372,17 @@ def show_artist(artist_id):
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+
+#   The version the edit form was filled from. Forms without the field skip the check,
+#   a value that doesn't parse is rejected rather than silently skipping it
+def submitted_version(form):
+  if 'version' not in request.form:
+    return None
+  if form.version.data is None:
+    abort(400)
+  return form.version.data
+
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   # TODO: populate form with fields from artist with ID <artist_id>
   artist = Artist.query.get(artist_id)
@@ -396,21 +393,28 @@ def edit_artist(artist_id):
   form = ArtistForm(data=artist)
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
+  artist_form = ArtistForm(request.form)
+  version = submitted_version(artist_form)
+  committed = False
   try:
-    artist_form = ArtistForm(request.form)
-    artist = Artist.query.get(artist_id)
-    artist.name = artist_form.name.data
-    artist.city = artist_form.city.data
-    artist.state = artist_form.state.data
-    artist.phone = artist_form.phone.data
-    artist.facebook_link = artist_form.facebook_link.data
-    artist.genres = ','.join(artist_form.genres.data)
-    db.session.add(artist)
+    changed = update_versioned(Artist, artist_id, version, {
+      'name': artist_form.name.data,
+      'city': artist_form.city.data,
+      'state': artist_form.state.data,
+      'phone': artist_form.phone.data,
+      'facebook_link': artist_form.facebook_link.data,
+      'genres': ','.join(artist_form.genres.data),
+    })
+    if changed is None:
+      db.session.rollback()
+      flash('Artist ' + artist_form.name.data + ' was changed by someone else while you were editing it. Please review the changes and try again.')
+      return redirect(url_for('main.edit_artist', artist_id=artist_id))
     db.session.commit()
+    committed = True
     # on successful db update, flash success
     flash('Artist ' + artist_form.name.data + ' was successfully updated!')
   except:
@@ -419,13 +423,15 @@ def edit_artist_submission(artist_id):
     flash('An error occurred. Artist ' + artist_form.name.data + ' could not be updated.')
   finally:
     db.session.close()
-  return redirect(url_for('show_artist', artist_id=artist_id))
+  if committed and changed:
+    after_commit('artist', [('notify_listing', 'Artist', artist_id, 'updated')])
+  return redirect(url_for('main.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
 
   # TODO: populate form with values from venue with ID <venue_id>
-  venue = Venue.query.get(venue_id)
+  venue = Venue.active().filter(Venue.id == venue_id).first()
   if venue is None:
         flash('An error occurred. Venue does not exist!')
         return render_template('pages/home.html')
@@ -433,22 +439,29 @@ def edit_venue(venue_id):
   form = VenueForm(data=venue)
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
+  venue_form = VenueForm(request.form)
+  version = submitted_version(venue_form)
+  committed = False
   try:
-    venue_form = VenueForm(request.form)
-    venue = Venue.query.get(venue_id)
-    venue.name = venue_form.name.data
-    venue.city = venue_form.city.data
-    venue.state = venue_form.state.data
-    venue.phone = venue_form.phone.data
-    venue.address = venue_form.address.data
-    venue.facebook_link = venue_form.facebook_link.data
-    venue.genres = ','.join(venue_form.genres.data)
-    db.session.add(venue)
+    changed = update_versioned(Venue, venue_id, version, {
+      'name': venue_form.name.data,
+      'city': venue_form.city.data,
+      'state': venue_form.state.data,
+      'phone': venue_form.phone.data,
+      'address': venue_form.address.data,
+      'facebook_link': venue_form.facebook_link.data,
+      'genres': ','.join(venue_form.genres.data),
+    })
+    if changed is None:
+      db.session.rollback()
+      flash('Venue ' + venue_form.name.data + ' was changed by someone else while you were editing it. Please review the changes and try again.')
+      return redirect(url_for('main.edit_venue', venue_id=venue_id))
     db.session.commit()
+    committed = True
     # on successful db update, flash success
     flash('Venue ' + venue_form.name.data + ' was successfully updated!')
   except:
@@ -457,21 +470,28 @@ def edit_venue_submission(venue_id):
     flash('An error occurred. Venue ' + venue_form.name.data + ' could not be updated.')
   finally:
     db.session.close()
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  if committed and changed:
+    jobs = [('notify_listing', 'Venue', venue_id, 'updated')]
+    # the coordinates only depend on where the venue is
+    if set(changed) & {'city', 'state', 'address'}:
+      jobs.insert(0, ('geocode_venue', venue_id))
+    after_commit('venue', jobs)
+  return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
+  committed = False
   try:
     new_data = ArtistForm(request.form)
     artist = Artist(name=new_data.name.data,
@@ -482,7 +502,10 @@ def create_artist_submission():
         facebook_link=new_data.facebook_link.data,
     )
     db.session.add(artist)
+    db.session.flush()
+    artist_id = artist.id
     db.session.commit()
+    committed = True
     # on successful db insert, flash success
     flash('Artist ' + new_data.name.data + ' was successfully listed!')
   except:
@@ -491,6 +514,8 @@ def create_artist_submission():
     flash('An error occurred. Artist ' + new_data.name.data + ' could not be listed.')
   finally:
     db.session.close()
+  if committed:
+    after_commit('artist', [('notify_listing', 'Artist', artist_id, 'listed')])
 
   return render_template('pages/home.html')
 
@@ -498,34 +523,40 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
 
-  shows = db.session.query(Show).order_by(Show.start_time)
-  data=[show.format for show in shows]
+  data = rows.show_rows()
   return render_template('pages/shows.html', shows=data)
 
-@app.route('/shows/create')
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
+  committed = False
   try:
     new_data = ShowForm(request.form)
+    if Venue.active().filter(Venue.id == new_data.venue_id.data).first() is None:
+      flash('An error occurred. Venue does not exist!')
+      return render_template('pages/home.html')
     show = Show(
             artist_id=new_data.artist_id.data,
             venue_id=new_data.venue_id.data,
             start_time=new_data.start_time.data
         )
     db.session.add(show)
+    db.session.flush()
+    show_id = show.id
     db.session.commit()
+    committed = True
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   except:
@@ -534,32 +565,81 @@ def create_show_submission():
     flash('An error occurred. Show could not be listed.')
   finally:
     db.session.close()
+  if committed:
+    after_commit(jobs=[('notify_listing', 'Show', show_id, 'listed')])
   return render_template('pages/home.html')
 
-@app.errorhandler(404)
+#  Admin
+#  ----------------------------------------------------------------
+
+@main.route('/admin/export/<entity>.<fmt>')
+def admin_export(entity, fmt):
+  # needs `Authorization: Bearer <EXPORT_TOKEN>`, the route doesn't exist without a token configured
+  token = current_app.config.get('EXPORT_TOKEN')
+  if not token or entity not in ('venues', 'artists', 'shows') or fmt not in export.FORMATS:
+    abort(404)
+  if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+    abort(403)
+  filename = '{}.{}'.format(entity, fmt)
+  chunk_size = current_app.config.get('EXPORT_CHUNK_SIZE', export.DEFAULT_CHUNK_SIZE)
+  if fmt == 'csv':
+    return Response(stream_with_context(export.iter_csv(entity, chunk_size)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+  # columnar files are written out in full before they can be sent
+  fd, path = tempfile.mkstemp(suffix='.' + fmt)
+  os.close(fd)
+  try:
+    export.write(entity, fmt, path, chunk_size)
+    f = open(path, 'rb')
+  finally:
+    os.remove(path)
+  return send_file(f, as_attachment=True, download_name=filename, mimetype='application/octet-stream')
+
+#  CLI
+#  ----------------------------------------------------------------
+
+@main.cli.command('export')
+@click.argument('entity', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='csv')
+@click.option('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+def export_command(entity, output, fmt, chunk_size):
+  # e.g. flask export shows shows.parquet --format parquet
+  count = export.write(entity, fmt, output, chunk_size)
+  click.echo('Exported {} {} to {}'.format(count, entity, output))
+
+@main.cli.command('geocode-venues')
+def geocode_venues():
+  # backfills coordinates for venues created before geocoding existed
+  venues = Venue.active().filter(Venue.latitude.is_(None)).all()
+  for venue in venues:
+    venue.geocode()
+  db.session.commit()
+  click.echo('Geocoded {} venues'.format(sum(1 for venue in venues if venue.latitude is not None)))
+
+@main.cli.command('compact-venues')
+@click.option('--batch-size', default=None, type=int, help='Venues (and shows) removed per transaction.')
+def compact_venues_command(batch_size):
+  # removes soft deleted venues and their shows, for when the background task didn't get to it
+  venues, shows = compact_deleted_venues(batch_size or current_app.config.get('VENUE_COMPACT_BATCH_SIZE', 1000))
+  click.echo('Removed {} deleted venues and {} shows'.format(venues, shows))
+
+@main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+app = create_app()
 
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
-# Default port:
+# Default port (development server only, production runs wsgi.py under gunicorn, see gunicorn.conf.py):
 if __name__ == '__main__':
     app.run()
 
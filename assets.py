@@ -0,0 +1,156 @@
+#----------------------------------------------------------------------------#
+# Static assets: fingerprinting, precompression and response compression.
+#
+# `flask assets build` copies every file under static/ to static/dist/ with
+# a content hash in its name (css/main.css -> dist/css/main.3f2a9c1b7d4e.css),
+# writes .gz (and .br when the brotli module is installed) siblings for text
+# assets and records the mapping in static/dist/manifest.json.
+#
+# Once a manifest exists, url_for('static', filename='css/main.css') emits the
+# fingerprinted URL, which is served with a far-future immutable
+# Cache-Control header and, when the client accepts it, precompressed.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.map', '.ico', '.eot', '.ttf')
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+IMMUTABLE = 'public, max-age={}, immutable'.format(ONE_YEAR)
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def build(static_folder, dist='dist'):
+    # Returns the manifest, {logical path: fingerprinted path}, both relative to static/
+    out_root = os.path.join(static_folder, dist)
+    if os.path.isdir(out_root):
+        shutil.rmtree(out_root)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and dist in dirs:
+            dirs.remove(dist)
+        for name in files:
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            stem, ext = os.path.splitext(logical)
+            fingerprinted = '{}/{}.{}{}'.format(dist, stem, _fingerprint(source), ext)
+            target = os.path.join(static_folder, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if ext.lower() in PRECOMPRESS_EXTENSIONS:
+                with open(source, 'rb') as f:
+                    data = f.read()
+                with gzip.open(target + '.gz', 'wb', compresslevel=9) as f:
+                    f.write(data)
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(data))
+            manifest[logical] = fingerprinted
+    with open(os.path.join(out_root, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.fingerprinted = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.dist = app.config.get('ASSETS_DIST', 'dist')
+        self.compress_level = app.config.get('COMPRESS_LEVEL', 6)
+        self.compress_min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.compress_mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ('text/html',)))
+        self.load_manifest()
+        app.url_defaults(self._rewrite_static_url)
+        app.view_functions['static'] = self._send_static
+        app.after_request(self._compress)
+        app.extensions['assets'] = self
+
+        assets_cli = AppGroup('assets', help='Build fingerprinted static assets.')
+
+        @assets_cli.command('build')
+        def build_command():
+            manifest = build(app.static_folder, self.dist)
+            self.load_manifest()
+            click.echo('Built {} assets into {}'.format(len(manifest), os.path.join(app.static_folder, self.dist)))
+
+        app.cli.add_command(assets_cli)
+
+    def load_manifest(self):
+        path = os.path.join(self.app.static_folder or '', self.dist, MANIFEST)
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except (IOError, ValueError):
+            self.manifest = {}
+        self.fingerprinted = set(self.manifest.values())
+
+    def _rewrite_static_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    def _send_static(self, filename):
+        if filename not in self.fingerprinted:
+            return self.app.send_static_file(filename)
+        accepted = request.headers.get('Accept-Encoding', '')
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if encoding in accepted and os.path.isfile(os.path.join(self.app.static_folder, filename + suffix)):
+                response = send_from_directory(self.app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0],
+                                               max_age=ONE_YEAR)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.app.static_folder, filename, max_age=ONE_YEAR)
+        # the name changes whenever the content does, so clients never need to revalidate
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _compress(self, response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.mimetype not in self.compress_mimetypes
+                or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+            return response
+        data = response.get_data()
+        if len(data) < self.compress_min_size:
+            return response
+        buffer = io.BytesIO()
+        with gzip.GzipFile(mode='wb', fileobj=buffer, compresslevel=self.compress_level) as f:
+            f.write(data)
+        response.set_data(buffer.getvalue())
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
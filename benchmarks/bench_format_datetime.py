@@ -0,0 +1,64 @@
+#----------------------------------------------------------------------------#
+# Per-row cost of the `datetime` Jinja filter.
+#
+#   python benchmarks/bench_format_datetime.py [rows]
+#
+# Compares the old round trip (strftime in Show.format, dateutil + babel in
+# the filter) with passing datetimes straight through, with the compiled
+# pattern cache cold and warm. Start times are spread over two years in
+# half-hour slots, like the seeded /shows pages, so most rows are distinct.
+#----------------------------------------------------------------------------#
+
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DATETIME_FORMATS, _compile_datetime_format, format_datetime
+
+
+def old_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = DATETIME_FORMATS['full']
+    elif format == 'medium':
+        format = DATETIME_FORMATS['medium']
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main(rows=20000):
+    start = datetime(2035, 4, 1, 0, 0)
+    rng = random.Random(0)
+    values = [start + timedelta(minutes=30 * rng.randrange(2 * 365 * 48)) for _ in range(rows)]
+
+    def old():
+        for value in values:
+            old_format_datetime(value.strftime("%m/%d/%Y, %H:%M:%S"), 'full')
+
+    def cold():
+        _compile_datetime_format.cache_clear()
+        for value in values:
+            format_datetime(value, 'full')
+
+    def warm():
+        for value in values:
+            format_datetime(value, 'full')
+
+    assert [old_format_datetime(v.strftime("%m/%d/%Y, %H:%M:%S"), 'full') for v in values[:50]] == \
+        [format_datetime(v, 'full') for v in values[:50]]
+    print('{} rows, {} distinct start times'.format(rows, len(set(values))))
+
+    warm()
+    for name, func in (('strftime + dateutil + babel', old), ('datetime, cold cache', cold), ('datetime, warm cache', warm)):
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print('{:<30} {:>8.2f} us/row'.format(name, seconds / rows * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,43 @@
+#----------------------------------------------------------------------------#
+# Cold start cost of a worker: how long `import app` takes.
+#
+#   python benchmarks/bench_import_time.py [runs] [top]
+#
+# Runs `python -X importtime -c "import app"` in fresh interpreters, reports
+# the best total and the modules with the largest cumulative import time.
+#----------------------------------------------------------------------------#
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times():
+    # {module: (self us, cumulative us)} for one fresh interpreter
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main(runs=5, top=15):
+    samples = [import_times() for _ in range(runs)]
+    best = min(samples, key=lambda times: times['app'][1])
+    print('import app: {:.1f} ms (best of {})'.format(best['app'][1] / 1000, runs))
+    print()
+    print('{:>10}  {:>10}  module'.format('self ms', 'cumul ms'))
+    for name, (self_us, cumulative_us) in sorted(best.items(), key=lambda item: -item[1][1])[:top]:
+        print('{:>10.1f}  {:>10.1f}  {}'.format(self_us / 1000, cumulative_us / 1000, name))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
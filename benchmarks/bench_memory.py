@@ -0,0 +1,93 @@
+#----------------------------------------------------------------------------#
+# Peak memory of the /shows read path: ORM instances + Show.format dicts
+# against the column-projected records in rows.py.
+#
+#   BENCH_DATABASE_URL=postgresql://... python benchmarks/bench_memory.py [shows]
+#
+# The database at BENCH_DATABASE_URL is emptied and seeded with `shows`
+# shows (100k by default), so point it at a scratch database. Each path runs
+# in a fresh interpreter and reports how far it pushed peak RSS above the
+# RSS right after `import app`.
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VENUES = 500
+ARTISTS = 2000
+CHUNK = 10000
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def seed(shows):
+    from app import app
+    from models import db, Venue, Artist, Show
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.text('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY CASCADE'))
+        db.session.execute(Venue.__table__.insert(), [
+            {'name': 'Venue %d' % i, 'city': 'San Francisco', 'state': 'CA', 'address': '%d Folsom Street' % i,
+             'genres': 'Jazz,Folk', 'image_link': 'https://images.example.com/venue-%d.jpg' % i}
+            for i in range(VENUES)])
+        db.session.execute(Artist.__table__.insert(), [
+            {'name': 'Artist %d' % i, 'city': 'San Francisco', 'state': 'CA', 'genres': 'Jazz',
+             'image_link': 'https://images.example.com/artist-%d.jpg' % i}
+            for i in range(ARTISTS)])
+        start = datetime(2019, 1, 1, 20, 0)
+        rng = random.Random(0)
+        for offset in range(0, shows, CHUNK):
+            db.session.execute(Show.__table__.insert(), [
+                {'venue_id': rng.randint(1, VENUES), 'artist_id': rng.randint(1, ARTISTS),
+                 'start_time': start + timedelta(hours=rng.randint(0, 24 * 365 * 20))}
+                for _ in range(min(CHUNK, shows - offset))])
+        db.session.commit()
+
+
+def measure(path):
+    from app import app
+    import rows
+    from models import db, Show
+    with app.test_request_context():
+        before = peak_rss_kb()
+        started = time.time()
+        if path == 'orm':
+            data = [show.format for show in db.session.query(Show).order_by(Show.start_time)]
+        else:
+            data = rows.show_rows()
+        seconds = time.time() - started
+        print(json.dumps({'path': path, 'rows': len(data), 'seconds': seconds,
+                          'peak_rss_mb': (peak_rss_kb() - before) / 1024}))
+
+
+def main(shows=100000):
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if not url:
+        sys.exit('Set BENCH_DATABASE_URL to a scratch database, it gets truncated.')
+    os.environ['DATABASE_URL'] = url
+    seed(shows)
+    print('{:<6} {:>8} {:>10} {:>14}'.format('path', 'rows', 'seconds', 'peak RSS MB'))
+    for path in ('orm', 'rows'):
+        output = subprocess.run([sys.executable, __file__, '--measure', path],
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print('{path:<6} {rows:>8} {seconds:>10.2f} {peak_rss_mb:>14.1f}'.format(**result))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,390 @@
+#----------------------------------------------------------------------------#
+# Load test: throughput and latency of the running app under a traffic mix
+# like production's, checked against a stored baseline.
+#
+#   python benchmarks/loadtest.py [--duration 30] [--concurrency 16]
+#   python benchmarks/loadtest.py --update-baseline
+#
+# By default a throwaway Postgres cluster is created with initdb (from PATH
+# or `pg_config --bindir`) and removed afterwards. LOADTEST_DATABASE_URL
+# points it at an existing database instead, which gets migrated, EMPTIED
+# and seeded, so only ever set it to a scratch one. The app's own
+# DATABASE_URL is never used.
+# The app is started the way production runs it (gunicorn with
+# gunicorn.conf.py, or `--server flask` for the development server), rate
+# limiting off, and driven by asyncio clients over plain keep-alive HTTP/1.1.
+#
+# Results are compared with benchmarks/loadtest_baseline.json: the script
+# exits with 1 when throughput drops, or p50/p99 latency of a scenario rises,
+# by more than --tolerance, or when more requests fail than before, and with 2
+# when there is no baseline to compare with, so a gate never passes unchecked.
+# Baselines only mean something on the machine that recorded them, so record
+# one per machine that gates deploys (--update-baseline); --report-only just
+# prints the numbers.
+#----------------------------------------------------------------------------#
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'loadtest_baseline.json')
+
+VENUES = 200
+ARTISTS = 1000
+SHOWS = 20000
+CHUNK = 10000
+
+SEARCH_TERMS = ('venue 1', 'artist 2', 'jazz', 'san', 'rock n', 'new york', 'art')
+
+# share of the requests per scenario, roughly what production sees
+SCENARIOS = {
+    'listing': 40,
+    'detail': 35,
+    'search': 20,
+    'create_show': 5,
+}
+
+
+#  Database
+#  ----------------------------------------------------------------
+
+def postgres_bindir():
+    initdb = shutil.which('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    try:
+        return subprocess.run(['pg_config', '--bindir'], stdout=subprocess.PIPE,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        sys.exit('No Postgres binaries (initdb) found, install them or set LOADTEST_DATABASE_URL to a scratch database.')
+
+
+@contextmanager
+def temporary_cluster():
+    # a private cluster on a unix socket in a temp directory, fsync off
+    bindir = postgres_bindir()
+    directory = tempfile.mkdtemp(prefix='fyyur-loadtest-')
+    data = os.path.join(directory, 'data')
+
+    def run(*args):
+        result = subprocess.run([os.path.join(bindir, args[0])] + list(args[1:]),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        if result.returncode:
+            sys.exit('{} failed:\n{}'.format(args[0], result.stdout))
+
+    try:
+        run('initdb', '-D', data, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-sync')
+        run('pg_ctl', '-D', data, '-l', os.path.join(directory, 'postgres.log'), '-w', 'start',
+            '-o', "-k {} -c listen_addresses='' -F".format(directory))
+        try:
+            run('createdb', '-h', directory, '-U', 'postgres', 'fyyur')
+            yield 'postgresql://postgres@/fyyur?host={}'.format(directory)
+        finally:
+            run('pg_ctl', '-D', data, '-m', 'fast', '-w', 'stop')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def flask_env(url):
+    return dict(os.environ, DATABASE_URL=url, FLASK_APP='app.py', RATELIMIT_ENABLED='0',
+                SECRET_KEY=os.environ.get('SECRET_KEY', 'loadtest'))
+
+
+def migrate(url):
+    subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'], cwd=ROOT, env=flask_env(url),
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def seed(url):
+    # runs in a child so the app (and its engine) never lives in the load generator
+    code = 'import sys; sys.path.insert(0, {!r}); import loadtest; loadtest._seed()'.format(os.path.dirname(__file__))
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=flask_env(url), check=True)
+
+
+def _seed():
+    sys.path.insert(0, ROOT)
+    from app import app
+    from models import db, Venue, Artist, Show
+    rng = random.Random(0)
+    cities = [('San Francisco', 'CA'), ('New York', 'NY'), ('Los Angeles', 'CA'), ('Austin', 'TX')]
+    genres = ['Jazz', 'Folk', 'Rock n Roll', 'Classical', 'Hip-Hop']
+    with app.app_context():
+        db.session.execute(db.text('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY CASCADE'))
+        db.session.execute(Venue.__table__.insert(), [
+            dict(zip(('city', 'state'), rng.choice(cities)), name='Venue %d' % i, address='%d Folsom Street' % i,
+                 genres=','.join(rng.sample(genres, 2)), image_link='https://images.example.com/venue-%d.jpg' % i)
+            for i in range(VENUES)])
+        db.session.execute(Artist.__table__.insert(), [
+            dict(zip(('city', 'state'), rng.choice(cities)), name='Artist %d' % i,
+                 genres=rng.choice(genres), image_link='https://images.example.com/artist-%d.jpg' % i)
+            for i in range(ARTISTS)])
+        # half the shows are still to come, like a live listing site
+        start = datetime.now() - timedelta(days=365)
+        for offset in range(0, SHOWS, CHUNK):
+            db.session.execute(Show.__table__.insert(), [
+                {'venue_id': rng.randint(1, VENUES), 'artist_id': rng.randint(1, ARTISTS),
+                 'start_time': start + timedelta(hours=rng.randint(0, 24 * 365 * 2))}
+                for _ in range(min(CHUNK, SHOWS - offset))])
+        db.session.commit()
+
+
+#  Server
+#  ----------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def server(url, port, log, kind='gunicorn'):
+    if kind == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{}'.format(port),
+                   'wsgi:app']
+    else:
+        command = [sys.executable, '-m', 'flask', 'run', '--host', '127.0.0.1', '--port', str(port), '--no-reload']
+    process = subprocess.Popen(command, cwd=ROOT, env=flask_env(url), stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    sys.exit('The app did not start, see {}'.format(log.name))
+                time.sleep(0.2)
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+#  Client
+#  ----------------------------------------------------------------
+
+class Connection(object):
+    # one keep-alive HTTP/1.1 connection, reopened when the server closes it
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, form=None):
+        reused = self.writer is not None
+        try:
+            return await self._request(method, path, form)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            # the server may drop an idle keep-alive connection, that's not the request's fault
+            if not reused:
+                raise
+            return await self._request(method, path, form)
+
+    async def _request(self, method, path, form):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = urlencode(form, doseq=True).encode() if form is not None else b''
+        head = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}:{}'.format(self.host, self.port),
+                'Content-Length: {}'.format(len(body))]
+        if form is not None:
+            head.append('Content-Type: application/x-www-form-urlencoded')
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed')
+        version, status = status_line.split()[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection') != 'close'
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            keep_alive = False
+        if not keep_alive:
+            self.close()
+        return int(status)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def pick_request(scenario, rng):
+    # (method, path, form) for one request of `scenario`
+    if scenario == 'listing':
+        return 'GET', rng.choice(('/venues', '/artists', '/shows')), None
+    if scenario == 'detail':
+        if rng.random() < 0.5:
+            return 'GET', '/venues/{}'.format(rng.randint(1, VENUES)), None
+        return 'GET', '/artists/{}'.format(rng.randint(1, ARTISTS)), None
+    if scenario == 'search':
+        path = rng.choice(('/search', '/venues/search', '/artists/search'))
+        return 'POST', path, {'search_term': rng.choice(SEARCH_TERMS)}
+    start_time = datetime.now() + timedelta(days=rng.randint(1, 365))
+    return 'POST', '/shows/create', {'artist_id': rng.randint(1, ARTISTS), 'venue_id': rng.randint(1, VENUES),
+                                     'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+async def user(port, seed, started, deadline, results):
+    rng = random.Random(seed)
+    names, weights = list(SCENARIOS), list(SCENARIOS.values())
+    connection = Connection('127.0.0.1', port)
+    loop = asyncio.get_running_loop()
+    try:
+        while loop.time() < deadline:
+            scenario = rng.choices(names, weights)[0]
+            method, path, form = pick_request(scenario, rng)
+            begin = loop.time()
+            try:
+                status = await connection.request(method, path, form)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                connection.close()
+                status = None
+            end = loop.time()
+            if begin >= started:
+                results.append((scenario, end - begin, status))
+    finally:
+        connection.close()
+
+
+async def drive(port, concurrency, warmup, duration):
+    loop = asyncio.get_running_loop()
+    started = loop.time() + warmup
+    deadline = started + duration
+    results = []
+    await asyncio.gather(*[user(port, seed, started, deadline, results) for seed in range(concurrency)])
+    return results
+
+
+#  Report
+#  ----------------------------------------------------------------
+
+def percentile(values, fraction):
+    # nearest rank on sorted values
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarise(results, duration, concurrency):
+    def stats(rows):
+        latencies = sorted(latency * 1000 for _, latency, _ in rows)
+        return {
+            'requests': len(rows),
+            'errors': sum(1 for _, _, status in rows if status is None or status >= 500),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p90_ms': round(percentile(latencies, 0.90), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+        }
+    total = stats(results)
+    return dict(total, duration_s=duration, concurrency=concurrency,
+                throughput_rps=round(len(results) / float(duration), 1),
+                error_rate=round(total['errors'] / float(len(results) or 1), 4),
+                scenarios={name: stats([row for row in results if row[0] == name]) for name in SCENARIOS})
+
+
+def print_report(report):
+    print('{:<12} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+        'scenario', 'requests', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for name, stats in sorted(report['scenarios'].items()) + [('total', report)]:
+        print('{:<12} {requests:>9} {errors:>7} {p50_ms:>9.1f} {p90_ms:>9.1f} {p99_ms:>9.1f} {max_ms:>9.1f}'.format(
+            name, **stats))
+    print('{throughput_rps} requests/s over {duration_s}s with {concurrency} clients, '
+          '{error_rate:.2%} errors'.format(**report))
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    if report['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        found.append('throughput {throughput_rps} requests/s, baseline {0}'.format(baseline['throughput_rps'], **report))
+    if report['error_rate'] > baseline['error_rate'] + 0.01:
+        found.append('error rate {error_rate:.2%}, baseline {0:.2%}'.format(baseline['error_rate'], **report))
+    for name, stats in report['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before or not stats['requests']:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if stats[key] > before[key] * (1 + tolerance):
+                found.append('{} {} {} ms, baseline {} ms'.format(name, key, stats[key], before[key]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the app and compare with the stored baseline.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds measured, after the warmup.')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds of load before measuring.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Simultaneous clients.')
+    parser.add_argument('--server', choices=('gunicorn', 'flask'), default='gunicorn')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed slowdown against the baseline.')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='Store this run as the new baseline.')
+    parser.add_argument('--report-only', action='store_true', help='Print the results without comparing them.')
+    parser.add_argument('--output', help='Also write the report as JSON here.')
+    args = parser.parse_args()
+    # checked before the run, not after half a minute of load
+    if not (args.update_baseline or args.report_only or os.path.exists(args.baseline)):
+        print('No baseline at {}, run with --update-baseline to record one.'.format(args.baseline))
+        return 2
+
+    url = os.environ.get('LOADTEST_DATABASE_URL')
+    if url and url == os.environ.get('DATABASE_URL'):
+        sys.exit('LOADTEST_DATABASE_URL is the app\'s DATABASE_URL, the load test would wipe it.')
+    with (nullcontext(url) if url else temporary_cluster()) as url:
+        migrate(url)
+        seed(url)
+        with tempfile.NamedTemporaryFile('w', prefix='fyyur-loadtest-', suffix='.log', delete=False) as log:
+            port = free_port()
+            with server(url, port, log, args.server):
+                results = asyncio.run(drive(port, args.concurrency, args.warmup, args.duration))
+        os.unlink(log.name)
+
+    report = dict(summarise(results, args.duration, args.concurrency), server=args.server)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+    if args.report_only:
+        return 0
+    with open(args.baseline) as f:
+        found = regressions(report, json.load(f), args.tolerance)
+    for regression in found:
+        print('REGRESSION: ' + regression)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#----------------------------------------------------------------------------#
+# Bulk export of venues, artists and shows to CSV, Parquet or Arrow.
+#
+# Rows are read through a server-side cursor (stream_results) in chunks of
+# `chunk_size`, and each chunk is written out before the next one is
+# fetched, so memory stays flat no matter how many shows there are.
+# Parquet and Arrow need pyarrow, which is only imported when used.
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, select
+
+from models import db, Venue, Artist, Show
+
+FORMATS = ('csv', 'parquet', 'arrow')
+
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def _venue_columns():
+    return [Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone, Venue.genres,
+            Venue.website, Venue.facebook_link, Venue.image_link, Venue.seeking_talent,
+            Venue.seeking_description, Venue.latitude, Venue.longitude]
+
+
+def _artist_columns():
+    return [Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone, Artist.genres,
+            Artist.website, Artist.facebook_link, Artist.image_link, Artist.seeking_venue,
+            Artist.seeking_description]
+
+
+def _show_columns():
+    return [Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+            Show.artist_id, Artist.name.label('artist_name')]
+
+
+def export_query(entity):
+    if entity == 'venues':
+        return select(*_venue_columns()).where(Venue.deleted_at.is_(None)).order_by(Venue.id)
+    if entity == 'artists':
+        return select(*_artist_columns()).order_by(Artist.id)
+    if entity == 'shows':
+        joined = Show.__table__ \
+            .join(Venue.__table__, Venue.id == Show.venue_id) \
+            .join(Artist.__table__, Artist.id == Show.artist_id)
+        return select(*_show_columns()).select_from(joined).where(Venue.deleted_at.is_(None)).order_by(Show.id)
+    raise ValueError('Unknown export {!r}'.format(entity))
+
+
+def iter_chunks(entity, chunk_size=DEFAULT_CHUNK_SIZE):
+    # yields (column names, [row, ...]) per chunk, the column names repeat on every chunk
+    query = export_query(entity)
+    conn = db.engine.connect().execution_options(stream_results=True)
+    try:
+        result = conn.execute(query)
+        names = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield names, rows
+    finally:
+        conn.close()
+
+
+def _csv_chunks(entity, chunk_size):
+    # (csv text, row count) per chunk, the first piece starts with the header
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.key for column in export_query(entity).selected_columns])
+    for names, rows in iter_chunks(entity, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue(), len(rows)
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue(), 0
+
+
+def iter_csv(entity, chunk_size=DEFAULT_CHUNK_SIZE):
+    # CSV text, one piece per chunk, for streaming responses
+    for text, count in _csv_chunks(entity, chunk_size):
+        yield text
+
+
+def _arrow_schema(entity):
+    import pyarrow as pa
+    fields = []
+    for column in export_query(entity).selected_columns:
+        if isinstance(column.type, Integer):
+            type_ = pa.int64()
+        elif isinstance(column.type, Float):
+            type_ = pa.float64()
+        elif isinstance(column.type, Boolean):
+            type_ = pa.bool_()
+        elif isinstance(column.type, DateTime):
+            type_ = pa.timestamp('us')
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(column.key, type_))
+    return pa.schema(fields)
+
+
+def write(entity, fmt, out, chunk_size=DEFAULT_CHUNK_SIZE):
+    # `out` is a path or a binary file object, returns the number of rows written
+    if fmt not in FORMATS:
+        raise ValueError('Unknown export format {!r}'.format(fmt))
+    count = 0
+    if fmt == 'csv':
+        target = open(out, 'wb') if isinstance(out, str) else out
+        try:
+            for text, rows in _csv_chunks(entity, chunk_size):
+                target.write(text.encode('utf-8'))
+                count += rows
+        finally:
+            if isinstance(out, str):
+                target.close()
+        return count
+    import pyarrow as pa
+    schema = _arrow_schema(entity)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(out, schema)
+    else:
+        writer = pa.ipc.new_file(out, schema)
+    try:
+        for names, rows in iter_chunks(entity, chunk_size):
+            columns = list(zip(*rows))
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+            if fmt == 'parquet':
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
@@ -13,6 +13,16 @@ def test():
         abort("Aborted at user request.")
 
 
+def perf():
+    # load test against the stored baseline, see benchmarks/loadtest.py
+    with settings(warn_only=True):
+        result = local("python benchmarks/loadtest.py --duration 30")
+    if result.return_code == 2:
+        abort("No load test baseline on this machine, record one with `python benchmarks/loadtest.py --update-baseline`.")
+    if result.failed and not confirm("Performance regressed. Continue?"):
+        abort("Aborted at user request.")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -24,6 +34,7 @@ def push():
 
 def prepare():
     test()
+    perf()
     commit()
     push()
 
@@ -47,6 +58,7 @@ def heroku_test():
 def deploy():
     pull()
     test()
+    perf()
     commit()
     heroku()
     heroku_test()
@@ -0,0 +1,82 @@
+#----------------------------------------------------------------------------#
+# Offline geocoding and distance helpers.
+#----------------------------------------------------------------------------#
+
+import csv
+import gzip
+import math
+import os
+import re
+import threading
+
+# Bundled US zip code dataset, so geocoding never leaves the box: every active
+# non-military zip with its city and GeoNames coordinates (CC BY 4.0), see README.
+ZIPCODES_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data', 'zipcodes.csv.gz')
+
+EARTH_RADIUS_KM = 6371.0
+
+_ZIP_RE = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+
+# USPS spells these out ("Saint Louis"), people usually don't
+_ABBREVIATIONS = {'st': 'saint', 'ste': 'sainte', 'ft': 'fort', 'mt': 'mount'}
+
+_by_city = None
+_by_zip = None
+_load_lock = threading.Lock()
+
+
+def _normalise(value):
+    words = (value or '').replace('.', '').lower().split()
+    return ' '.join(_ABBREVIATIONS.get(word, word) for word in words)
+
+
+def _load():
+    global _by_city, _by_zip
+    with _load_lock:
+        if _by_zip is not None:
+            return
+        sums, by_zip = {}, {}
+        with gzip.open(ZIPCODES_FILE, 'rt', newline='') as f:
+            for row in csv.DictReader(f):
+                lat, lng = float(row['latitude']), float(row['longitude'])
+                by_zip[row['zip']] = (lat, lng)
+                total = sums.setdefault((_normalise(row['city']), _normalise(row['state'])), [0.0, 0.0, 0])
+                total[0] += lat
+                total[1] += lng
+                total[2] += 1
+        # a city is placed at the mean of its zip codes
+        by_city = {key: (lat / n, lng / n) for key, (lat, lng, n) in sums.items()}
+        # geocode() checks _by_zip, so it is published last, once both tables are complete
+        _by_city = by_city
+        _by_zip = by_zip
+
+
+def geocode(city, state, address=None):
+    # Returns (latitude, longitude) or None. A zip code in the address wins
+    # over the city lookup since it is the more precise of the two.
+    if _by_zip is None:
+        _load()
+    match = _ZIP_RE.search(address or '')
+    if match and match.group(1) in _by_zip:
+        return _by_zip[match.group(1)]
+    return _by_city.get((_normalise(city), _normalise(state)))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat, lng, km):
+    # (min_lat, max_lat, min_lng, max_lng) enclosing the circle of radius `km`.
+    # Used as an index-friendly pre-filter before the exact haversine check.
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6:
+        return lat - dlat, lat + dlat, -180.0, 180.0
+    dlng = math.degrees(km / (EARTH_RADIUS_KM * cos_lat))
+    if lng - dlng < -180 or lng + dlng > 180:
+        return lat - dlat, lat + dlat, -180.0, 180.0
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
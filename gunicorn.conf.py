@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------------#
+# gunicorn settings for wsgi.py.
+#
+# The app is imported once in the master (preload_app) and the workers are
+# forked from it, so they share its memory pages and start instantly. What
+# can't cross a fork is rebuilt per worker in post_fork: database connections
+# opened while preloading and the metrics and log writer threads. The task
+# queue and rate limiter notice the new pid on their own. When a worker exits
+# (max_requests recycles them) its metrics are folded into the totals.
+#
+#   WEB_CONCURRENCY   worker processes (default 2 * cores + 1)
+#   GUNICORN_THREADS  threads per worker (default 2), each may hold a pooled
+#                     DB connection, so keep workers * threads within what
+#                     Postgres allows (max_connections)
+#   PORT / BIND       where to listen (default 0.0.0.0:8000)
+#----------------------------------------------------------------------------#
+
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', 8000)))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then so a slow leak can't grow forever
+max_requests = 5000
+max_requests_jitter = 500
+
+# every worker writes its metrics here and /metrics adds them up (read by config.py). It is
+# emptied on start, so unless set the directory belongs to this master process alone and goes
+# away with it; another instance on the host never shares, or wipes, it
+_own_metrics_dir = os.path.join(tempfile.gettempdir(), 'fyyur-metrics-{}'.format(os.getpid()))
+os.environ.setdefault('METRICS_MULTIPROC_DIR', _own_metrics_dir)
+
+
+def on_starting(server):
+    # snapshots left by the previous run would be counted again
+    for path in glob.glob(os.path.join(os.environ['METRICS_MULTIPROC_DIR'], '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    # close whatever the master connected while preloading, before any worker inherits it
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    from app import app, db
+    # a fresh pool per worker, two processes must never share a connection
+    with app.app_context():
+        db.engine.dispose()
+    app.extensions['request_log'].start()
+    app.extensions['metrics'].start()
+
+
+def worker_exit(server, worker):
+    # the last counts since the previous snapshot
+    from app import app
+    app.extensions['metrics'].flush()
+
+
+def child_exit(server, worker):
+    # in the master: the exited worker's counters go into one file instead of leaving its snapshot behind
+    from app import app
+    app.extensions['metrics'].retire(worker.pid)
+
+
+def on_exit(server):
+    if os.environ['METRICS_MULTIPROC_DIR'] == _own_metrics_dir:
+        shutil.rmtree(_own_metrics_dir, ignore_errors=True)
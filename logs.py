@@ -0,0 +1,218 @@
+#----------------------------------------------------------------------------#
+# Structured access and error logs.
+#
+# Records are formatted as one JSON object per line on the request thread and
+# handed to a QueueHandler; a QueueListener thread per process does the file
+# writes, so a slow disk never holds up a response.
+#
+#   access.log - one line per request: request id, endpoint, status, duration
+#                and the number and total time of SQL statements it ran.
+#                Endpoints in ACCESS_LOG_SAMPLE_RATES are sampled, errors and
+#                requests slower than ACCESS_LOG_SLOW_SECONDS always make it.
+#   error.log  - app.logger and the LOG_LOGGERS loggers (INFO and up), tagged
+#                with the request id when logged during a request.
+#
+# The request id is taken from an incoming X-Request-ID header (set by the
+# proxy) or generated, and sent back in the response.
+#----------------------------------------------------------------------------#
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_REQUEST_ID_RE = re.compile(r'^[\w.:-]{1,128}$')
+
+# attributes every LogRecord has, anything else was passed in `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# The loggers are process wide (app.logger too, every app of this module is named 'app'), so
+# the pipelines are as well: one per file, shared by every RequestLog that writes to it
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+_pipelines_pid = None
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    # runs on the thread that logs, where the request context is still around
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id') and has_request_context():
+            record.request_id = g.get('request_id')
+        return True
+
+
+class RequestLog(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.sample_rates = app.config.get('ACCESS_LOG_SAMPLE_RATES', {})
+        self.slow_seconds = app.config.get('ACCESS_LOG_SLOW_SECONDS', 1.0)
+        directory = app.config.get('LOG_DIR', '.')
+        level = app.config.get('LOG_LEVEL', logging.INFO)
+
+        self.access_logger = logging.getLogger('fyyur.access')
+        self.access_logger.setLevel(logging.INFO)
+        self.access_logger.propagate = False
+        _add_pipeline([self.access_logger], os.path.join(directory, 'access.log'))
+
+        # Flask's stderr handler would write on the request thread
+        app.logger.removeHandler(default_handler)
+        loggers = [app.logger] + [logging.getLogger(name) for name in app.config.get('LOG_LOGGERS', ())]
+        for logger in loggers:
+            logger.setLevel(level)
+        _add_pipeline(loggers, os.path.join(directory, 'error.log'))
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.extensions['request_log'] = self
+        self.start()
+
+    def start(self):
+        _start()
+
+    def stop(self):
+        _stop()
+
+    #  Hooks
+    #  ----------------------------------------------------------------
+
+    def _before_request(self):
+        self.start()
+        request_id = request.headers.get('X-Request-ID', '')
+        g.request_id = request_id if _REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex
+        g.request_started = time.time()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+
+    def _after_request(self, response):
+        if 'request_id' not in g:
+            return response
+        response.headers['X-Request-ID'] = g.request_id
+        duration = time.time() - g.request_started
+        if self._sampled(request.endpoint, response.status_code, duration):
+            self.access_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'request_id': g.request_id,
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'db_queries': g.db_queries,
+                'db_ms': round(g.db_seconds * 1000, 2),
+                'bytes': response.calculate_content_length(),
+                'remote_addr': request.remote_addr,
+                'user_agent': request.user_agent.string,
+            })
+        return response
+
+    def _sampled(self, endpoint, status, duration):
+        if status >= 500 or duration >= self.slow_seconds:
+            return True
+        rate = self.sample_rates.get(endpoint, 1.0)
+        return rate >= 1 or random.random() < rate
+
+
+
+def _add_pipeline(loggers, path):
+    path = os.path.abspath(path)
+    with _pipelines_lock:
+        if path not in _pipelines:
+            handler = QueueHandler(None)
+            handler.setFormatter(JSONFormatter())
+            handler.addFilter(RequestIdFilter())
+            # delay=True leaves opening the file to the first record
+            file_handler = WatchedFileHandler(path, delay=True)
+            file_handler.setFormatter(logging.Formatter('%(message)s'))
+            _pipelines[path] = (handler, QueueListener(None, file_handler))
+            if _pipelines_pid == os.getpid():
+                _start_pipeline(*_pipelines[path])
+        handler = _pipelines[path][0]
+    # a logger never gets the same handler twice
+    for logger in loggers:
+        logger.addHandler(handler)
+
+
+def _start_pipeline(handler, listener):
+    # a queue inherited across a fork may have its lock held by the parent's listener
+    handler.queue = listener.queue = queue.Queue(-1)
+    listener._thread = None
+    listener.start()
+
+
+def _start():
+    # listener threads don't survive a fork, every process starts its own
+    global _pipelines_pid
+    if _pipelines_pid == os.getpid():
+        return
+    with _pipelines_lock:
+        if _pipelines_pid == os.getpid():
+            return
+        for handler, listener in _pipelines.values():
+            _start_pipeline(handler, listener)
+        _pipelines_pid = os.getpid()
+
+
+def _stop():
+    # flushes what is still queued
+    global _pipelines_pid
+    with _pipelines_lock:
+        if _pipelines_pid != os.getpid():
+            return
+        for handler, listener in _pipelines.values():
+            listener.stop()
+        _pipelines_pid = None
+
+
+atexit.register(_stop)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('request_log_started', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('request_log_started')
+    if not started:
+        return
+    elapsed = time.time() - started.pop()
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
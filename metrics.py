@@ -0,0 +1,355 @@
+#----------------------------------------------------------------------------#
+# Prometheus metrics.
+#
+# Request counts and latency per endpoint and DB query counts and time are
+# recorded as they happen; everything else (pool usage, cache, task and
+# rate limit counters) is read by collectors when /metrics is scraped.
+#
+# With METRICS_MULTIPROC_DIR set, every worker process writes a snapshot of
+# its metrics to <dir>/<pid>-<start>.json every METRICS_FLUSH_INTERVAL
+# seconds, and /metrics serves the sum over all snapshots, so it doesn't
+# matter which gunicorn worker answers the scrape. Counters and histograms of
+# workers that have exited keep counting towards the totals, gauges only
+# count for live workers. When a worker exits its snapshot is folded into
+# <dir>/retired.json (see `retire`), so recycled workers don't pile up files.
+# Empty the directory whenever the server restarts.
+#
+# /metrics needs `Authorization: Bearer <METRICS_TOKEN>` and doesn't exist
+# without a token configured.
+#----------------------------------------------------------------------------#
+
+import bisect
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+
+from flask import Response, abort, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+RETIRED = 'retired.json'
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [per bucket counts (last one is +Inf), sum, count]
+            counts, total, count = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self.values.items()]
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+
+    def __init__(self, app=None):
+        self.metrics = {}
+        self.collectors = []
+        self._pid = None
+        self._started = None
+        self._lock = threading.Lock()
+        self.requests = self.counter('fyyur_http_requests_total', 'HTTP requests handled.',
+                                     ('endpoint', 'method', 'status'))
+        self.latency = self.histogram('fyyur_http_request_duration_seconds', 'Time spent handling a request.',
+                                      ('endpoint',), REQUEST_BUCKETS)
+        self.queries = self.counter('fyyur_db_queries_total', 'SQL statements executed.')
+        self.query_time = self.histogram('fyyur_db_query_duration_seconds', 'Time spent executing a statement.',
+                                         (), QUERY_BUCKETS)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.token = app.config.get('METRICS_TOKEN')
+        self.directory = app.config.get('METRICS_MULTIPROC_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        # every engine, so it doesn't matter when Flask-SQLAlchemy gets around to creating one; the
+        # listeners are shared by all apps and count each statement for the app it runs under
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, func):
+        # func() runs before every snapshot and scrape to refresh gauges and mirrored counters
+        self.collectors.append(func)
+        return func
+
+    #  Hooks
+    #  ----------------------------------------------------------------
+
+    def _before_request(self):
+        # once per process, after the fork when running under gunicorn
+        self.start()
+        g.metrics_started = time.time()
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            self.latency.observe(time.time() - started, endpoint=endpoint)
+            self.requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    #  Snapshots
+    #  ----------------------------------------------------------------
+
+    def collect(self):
+        for func in self.collectors:
+            try:
+                with self.app.app_context():
+                    func()
+            except Exception:
+                self.app.logger.warning('Metrics collector %s failed', func.__name__, exc_info=True)
+        return {
+            name: {'type': metric.type, 'help': metric.help, 'labelnames': list(metric.labelnames),
+                   'buckets': list(getattr(metric, 'buckets', ())), 'samples': metric.samples()}
+            for name, metric in self.metrics.items()
+        }
+
+    def start(self):
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._started = int(time.time() * 1000)
+            os.makedirs(self.directory, exist_ok=True)
+            thread = threading.Thread(target=self._flush_forever, name='metrics-flush')
+            thread.daemon = True
+            thread.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.warning('Could not write metrics snapshot', exc_info=True)
+
+    def flush(self):
+        # only once start() has run in this process, the file is named after its pid and start time
+        if not self.directory or self._pid != os.getpid():
+            return
+        path = os.path.join(self.directory, '{}-{}.json'.format(os.getpid(), self._started))
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.collect(), f)
+        os.replace(tmp, path)
+
+    def _snapshots(self):
+        if not self.directory:
+            yield True, self.collect()
+            return
+        self.start()
+        self.flush()
+        # the snapshots are read before retired.json: a snapshot that has been folded
+        # in the meantime is then listed there and skipped, so nothing counts twice or not at all
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append((os.path.basename(path), json.load(f)))
+            except (IOError, ValueError):
+                continue
+        retired = self._load_retired()
+        yield False, retired['metrics']
+        for name, snapshot in snapshots:
+            if name not in retired['folded']:
+                yield _alive(int(name.split('-')[0])), snapshot
+
+    def _load_retired(self):
+        try:
+            with open(os.path.join(self.directory, RETIRED)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'folded': [], 'metrics': {}}
+
+    def retire(self, pid):
+        # Adds the counters and histograms of an exited worker to retired.json and removes its
+        # snapshot. Called by the gunicorn master for every worker it reaps, never concurrently
+        if not self.directory:
+            return
+        paths = glob.glob(os.path.join(self.directory, '{}-*.json'.format(pid)))
+        if not paths:
+            return
+        retired = self._load_retired()
+        snapshots = [(False, retired['metrics'])]
+        for path in paths:
+            try:
+                with open(path) as f:
+                    snapshots.append((False, json.load(f)))
+            except (IOError, ValueError):
+                continue
+        merged = _merge(snapshots)
+        for metric in merged.values():
+            metric['samples'] = [[list(key), value] for key, value in metric['samples'].items()]
+        # names of snapshots still on disk, so readers can tell they are already counted here
+        folded = [name for name in retired['folded'] if os.path.exists(os.path.join(self.directory, name))]
+        folded += [os.path.basename(path) for path in paths]
+        path = os.path.join(self.directory, RETIRED)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'folded': folded, 'metrics': merged}, f)
+        os.replace(path + '.tmp', path)
+        for path in paths:
+            os.remove(path)
+
+    def aggregate(self):
+        return _merge(self._snapshots())
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.aggregate().items()):
+            lines.append('# HELP {} {}'.format(name, metric['help']))
+            lines.append('# TYPE {} {}'.format(name, metric['type']))
+            names = metric['labelnames']
+            for labels, value in sorted(metric['samples'].items()):
+                if metric['type'] != 'histogram':
+                    lines.append('{}{} {}'.format(name, _labels(names, labels), _number(value)))
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(list(metric['buckets']) + ['+Inf'], counts):
+                    cumulative += bucket
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(names, labels, [('le', str(bound))]), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(names, labels), _number(total)))
+                lines.append('{}_count{} {}'.format(name, _labels(names, labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        if not self.token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + self.token):
+            abort(403)
+        return Response(self.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+
+def _merge(snapshots):
+    # sums (alive, snapshot) pairs, gauges only count for live processes
+    merged = {}
+    for alive, snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if metric['type'] == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                if metric['type'] == 'histogram':
+                    counts, total, count = target['samples'].get(key) or ([0] * len(value[0]), 0.0, 0)
+                    value = ([a + b for a, b in zip(counts, value[0])], total + value[1], count + value[2])
+                else:
+                    value = target['samples'].get(key, 0) + value
+                target['samples'][key] = value
+    return merged
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    elapsed = time.time() - started.pop()
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    if metrics is not None and metrics.enabled:
+        metrics.queries.inc()
+        metrics.query_time.observe(elapsed)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
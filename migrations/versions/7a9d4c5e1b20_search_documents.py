@@ -0,0 +1,57 @@
+"""search documents
+
+Revision ID: 7a9d4c5e1b20
+Revises: 3c1f8e2a9d47
+Create Date: 2026-10-19 10:03:51.402977
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7a9d4c5e1b20'
+down_revision = '3c1f8e2a9d47'
+branch_labels = None
+depends_on = None
+
+
+# Name weighs most, then location, then genres, then the free text description.
+# Genres are stored comma separated, so commas are turned into spaces first.
+SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION "{table}_search_document_update"() RETURNS trigger AS $$
+BEGIN
+  NEW.search_document :=
+    setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+    setweight(to_tsvector('simple', replace(coalesce(NEW.genres, ''), ',', ' ')), 'C') ||
+    setweight(to_tsvector('simple', coalesce(NEW.seeking_description, '')), 'D');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+SEARCH_DOCUMENT_TRIGGER = """
+CREATE TRIGGER "{table}_search_document_trigger"
+BEFORE INSERT OR UPDATE OF name, city, state, genres, seeking_description ON "{table}"
+FOR EACH ROW EXECUTE PROCEDURE "{table}_search_document_update"();
+"""
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('search_document', postgresql.TSVECTOR(), nullable=True))
+        op.execute(SEARCH_DOCUMENT_FUNCTION.format(table=table))
+        op.execute(SEARCH_DOCUMENT_TRIGGER.format(table=table))
+        # fire the trigger once for the existing rows
+        op.execute('UPDATE "{table}" SET name = name'.format(table=table))
+        op.create_index('ix_{}_search_document'.format(table), table, ['search_document'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index('ix_{}_search_document'.format(table), table_name=table)
+        op.execute('DROP TRIGGER IF EXISTS "{table}_search_document_trigger" ON "{table}"'.format(table=table))
+        op.execute('DROP FUNCTION IF EXISTS "{table}_search_document_update"()'.format(table=table))
+        op.drop_column(table, 'search_document')
@@ -0,0 +1,41 @@
+"""soft delete venues
+
+Revision ID: 8b3f6a2d9e51
+Revises: 5d2e8f1a6c93
+Create Date: 2026-10-19 20:31:52.906311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3f6a2d9e51'
+down_revision = '5d2e8f1a6c93'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # reads only ever look at live venues, so the existing indexes become partial
+    op.drop_index('ix_Venue_latitude_longitude', table_name='Venue')
+    op.create_index('ix_Venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False, postgresql_where=LIVE)
+    op.drop_index('ix_Venue_search_document', table_name='Venue')
+    op.create_index('ix_Venue_search_document', 'Venue', ['search_document'], unique=False, postgresql_using='gin', postgresql_where=LIVE)
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city', 'id'], unique=False, postgresql_where=LIVE)
+    op.create_index('ix_Venue_deleted_at', 'Venue', ['deleted_at'], unique=False, postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_Show_venue_id', 'Show', ['venue_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_venue_id', table_name='Show')
+    op.drop_index('ix_Venue_deleted_at', table_name='Venue')
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_Venue_search_document', table_name='Venue')
+    op.create_index('ix_Venue_search_document', 'Venue', ['search_document'], unique=False, postgresql_using='gin')
+    op.drop_index('ix_Venue_latitude_longitude', table_name='Venue')
+    op.create_index('ix_Venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False)
+    op.drop_column('Venue', 'deleted_at')
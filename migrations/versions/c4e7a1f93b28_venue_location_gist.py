@@ -0,0 +1,31 @@
+"""venue location gist index
+
+Revision ID: c4e7a1f93b28
+Revises: 8b3f6a2d9e51
+Create Date: 2026-10-19 22:14:08.530716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a1f93b28'
+down_revision = '8b3f6a2d9e51'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+
+
+def upgrade():
+    # a B-tree on (latitude, longitude) only seeks on latitude, a GiST index on the point
+    # answers `point <@ box` on both axes
+    op.drop_index('ix_Venue_latitude_longitude', table_name='Venue')
+    op.create_index('ix_Venue_location', 'Venue', [sa.text('point(longitude, latitude)')], unique=False,
+                    postgresql_using='gist', postgresql_where=LIVE)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_location', table_name='Venue')
+    op.create_index('ix_Venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False, postgresql_where=LIVE)
@@ -0,0 +1,338 @@
+#----------------------------------------------------------------------------#
+# Models.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.hybrid import hybrid_property
+
+import geo
+
+db = SQLAlchemy()
+
+#   Optimistic locking for the edit forms. `values` are compared with the stored row and only the
+#   columns that differ are written, in a single UPDATE ... WHERE id AND version that also bumps the version.
+#   Returns the names of the changed columns, or None when the row was saved by someone else since
+#   `version` was read (or is gone, soft deleted included). Without a `version` only a change between the
+#   read and the write conflicts
+def update_versioned(model, id, version, values):
+    names = list(values)
+    live = [model.deleted_at.is_(None)] if hasattr(model, 'deleted_at') else []
+    row = db.session.query(model.version, *[getattr(model, name) for name in names]) \
+        .filter(model.id == id, *live) \
+        .first()
+    if row is None or (version is not None and row[0] != version):
+        return None
+    changed = {name: values[name] for name, current in zip(names, row[1:]) if values[name] != current}
+    if not changed:
+        return []
+    updated = model.query \
+        .filter(model.id == id, model.version == row[0], *live) \
+        .update(dict(changed, version=model.version + 1), synchronize_session=False)
+    return sorted(changed) if updated else None
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    address = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+
+    genres = db.Column(db.String())
+    website = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(500))
+
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+
+    #   Bumped by every edit through `update_versioned`
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    #   Maintained by a database trigger from name, city, state, genres and seeking_description
+    search_document = db.deferred(db.Column(TSVECTOR))
+
+    #   Set when the venue is deleted, `compact_deleted_venues` removes the row and its shows later
+    deleted_at = db.Column(db.DateTime)
+
+    #   Every read filters on deleted_at IS NULL, so the indexes only cover live venues
+    __table_args__ = (
+        db.Index('ix_Venue_location', db.func.point(longitude, latitude), postgresql_using='gist',
+                 postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Venue_search_document', 'search_document', postgresql_using='gin',
+                 postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Venue_state_city', 'state', 'city', 'id', postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Venue_deleted_at', 'deleted_at', postgresql_where=deleted_at.isnot(None)),
+    )
+
+    #   Venues that haven't been deleted, the starting point for every read
+    @staticmethod
+    def active():
+        return Venue.query.filter(Venue.deleted_at.is_(None))
+
+    @hybrid_property
+    def format(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'city': self.city,
+            'state': self.state,
+            'phone': self.phone,
+            'address': self.address,
+            'image_link': self.image_link,
+            'facebook_link': self.facebook_link,
+            'genres': self.genres.split(','),
+            'website': self.website,
+            'seeking_talent': self.seeking_talent,
+            'seeking_description': self.seeking_description,
+            'num_upcoming_shows': self.get_upcoming_shows_count(),
+            'version': self.version
+        }
+
+    @hybrid_property
+    def format_short(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'num_upcoming_shows': self.get_upcoming_shows_count()
+        }
+
+
+    #   Using hybrid_property to be able call these function in the controllers below
+    @hybrid_property
+    def format_full(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'genres': self.genres.split(','),
+            'address': self.address,
+            'city': self.city,
+            'state': self.state,
+            'phone': self.phone,
+            'website': self.website,
+            'facebook_link': self.facebook_link,
+            'seeking_talent': self.seeking_talent,
+            'seeking_description': self.seeking_description,
+            'image_link': current_app.extensions['thumbnails'].url(self.image_link, 'large'),
+            'past_shows': [show.format for show in self.get_past_shows()],
+            'upcoming_shows': [show.format for show in self.get_upcoming_shows()],
+            'past_shows_count': self.get_past_shows_count(),
+            'upcoming_shows_count': self.get_upcoming_shows_count()
+        }
+
+    #   This function will call upon `get_venues_in_area` as a helper function to ease formatting venues by cities and states
+    @hybrid_property
+    def format_by_area(self):
+        return {
+            'city': self.city,
+            'state': self.state,
+            'venues': [venue.format_short for venue in self.get_venues_in_area()]
+        }
+
+    #   A helper function when I am trying to format correctly the venues so they display per city and state
+    def get_venues_in_area(self):
+        return Venue.active().filter(Venue.city == self.city, Venue.state == self.state).all()
+
+    def get_past_shows(self):
+        return Show.query.filter(Show.start_time < datetime.now(), Show.venue_id == self.id).all()
+
+    def get_upcoming_shows(self):
+        return Show.query.filter(Show.start_time > datetime.now(), Show.venue_id == self.id).all()
+
+    def get_past_shows_count(self):
+        return len(Show.query.filter(Show.start_time < datetime.now(), Show.venue_id == self.id).all())
+
+    def get_upcoming_shows_count(self):
+        return len(Show.query.filter(Show.start_time > datetime.now(), Show.venue_id == self.id).all())
+
+    #   Fills latitude/longitude from the bundled city/zip dataset, left empty when the place is unknown
+    def geocode(self):
+        point = geo.geocode(self.city, self.state, self.address)
+        self.latitude, self.longitude = point if point else (None, None)
+
+    #   Ids of the venues within `km` of a point, nearest first, as (venue_id, distance) pairs.
+    #   The bounding box runs against the GiST index on point(longitude, latitude), the exact distance is checked here
+    @staticmethod
+    def nearby(lat, lng, km):
+        min_lat, max_lat, min_lng, max_lng = geo.bounding_box(lat, lng, km)
+        box = db.func.box(db.func.point(min_lng, min_lat), db.func.point(max_lng, max_lat))
+        candidates = Venue.active().filter(
+            db.func.point(Venue.longitude, Venue.latitude).op('<@')(box)
+        ).with_entities(Venue.id, Venue.latitude, Venue.longitude)
+        results = []
+        for venue_id, venue_lat, venue_lng in candidates:
+            distance = geo.haversine_km(lat, lng, venue_lat, venue_lng)
+            if distance <= km:
+                results.append((venue_id, distance))
+        results.sort(key=lambda result: result[1])
+        return results
+
+
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    genres = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+
+    website = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(500))
+
+    #   Bumped by every edit through `update_versioned`
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    #   Maintained by a database trigger from name, city, state, genres and seeking_description
+    search_document = db.deferred(db.Column(TSVECTOR))
+
+    __table_args__ = (
+        db.Index('ix_Artist_search_document', 'search_document', postgresql_using='gin'),
+    )
+
+    @hybrid_property
+    def format(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'city': self.city,
+            'state': self.state,
+            'phone': self.phone,
+            'image_link': self.image_link,
+            'facebook_link': self.facebook_link,
+            'genres': self.genres.split(','),
+            'website': self.website,
+            'seeking_venue': self.seeking_venue,
+            'seeking_description': self.seeking_description,
+            'num_upcoming_shows': self.get_upcoming_shows_count(),
+            'version': self.version
+        }
+
+    @hybrid_property
+    def format_short(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'num_upcoming_shows': self.get_upcoming_shows_count()
+        }
+
+    @hybrid_property
+    def format_full(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'genres': self.genres.split(','),
+            'city': self.city,
+            'state': self.state,
+            'phone': self.phone,
+            'website': self.website,
+            'facebook_link': self.facebook_link,
+            'seeking_venue': self.seeking_venue,
+            'seeking_description': self.seeking_description,
+            'image_link': current_app.extensions['thumbnails'].url(self.image_link, 'large'),
+            'past_shows': [show.format for show in self.get_past_shows()],
+            'upcoming_shows': [show.format for show in self.get_upcoming_shows()],
+            'past_shows_count': self.get_past_shows_count(),
+            'upcoming_shows_count': self.get_upcoming_shows_count()
+        }
+
+    def get_past_shows(self):
+        return Show.active().filter(Show.start_time < datetime.now(), Show.artist_id == self.id).all()
+
+    def get_upcoming_shows(self):
+        return Show.active().filter(Show.start_time > datetime.now(), Show.artist_id == self.id).all()
+
+    def get_past_shows_count(self):
+        return len(Show.active().filter(Show.start_time < datetime.now(), Show.artist_id == self.id).all())
+
+    def get_upcoming_shows_count(self):
+        return len(Show.active().filter(Show.start_time > datetime.now(), Show.artist_id == self.id).all())
+
+
+class Show(db.Model):
+    __tablename__ = 'Show'
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_Show_venue_id', 'venue_id'),
+    )
+
+    #   Shows whose venue hasn't been deleted
+    @staticmethod
+    def active():
+        return Show.query.join(Venue, Venue.id == Show.venue_id).filter(Venue.deleted_at.is_(None))
+
+    @hybrid_property
+    def format(self):
+        return {
+            'id': self.id,
+            'venue_id': self.venue_id,
+            'venue_name': self.get_venue_name(),
+            'venue_image_link': current_app.extensions['thumbnails'].url(self.get_venue_image()),
+            'artist_id': self.artist_id,
+            'artist_name': self.get_artist_name(),
+            'artist_image_link': current_app.extensions['thumbnails'].url(self.get_artist_image()),
+            'start_time': self.start_time
+        }
+
+    def get_venue_name(self):
+        venue = Venue.query.get(self.venue_id)
+        return venue.name
+
+    def get_artist_name(self):
+        artist = Artist.query.get(self.artist_id)
+        return artist.name
+
+    def get_artist_image(self):
+        artist = Artist.query.get(self.artist_id)
+        return artist.image_link
+
+    def get_venue_image(self):
+        venue = Venue.query.get(self.venue_id)
+        return venue.image_link
+
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+
+# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+
+
+#   Hard deletes venues that were soft deleted before `before` (all of them by default), with their shows.
+#   Works through `batch_size` venues at a time and deletes their shows in batches of the same size
+#   through ix_Show_venue_id, committing after every batch so no statement holds its locks for long.
+#   Returns (venues, shows) deleted
+def compact_deleted_venues(batch_size=1000, before=None):
+    venues = shows = 0
+    while True:
+        query = db.session.query(Venue.id).filter(Venue.deleted_at.isnot(None))
+        if before is not None:
+            query = query.filter(Venue.deleted_at < before)
+        ids = [id for id, in query.order_by(Venue.id).limit(batch_size)]
+        if not ids:
+            return venues, shows
+        while True:
+            batch = db.session.query(Show.id).filter(Show.venue_id.in_(ids)).limit(batch_size)
+            deleted = Show.query.filter(Show.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+            shows += deleted
+            if deleted < batch_size:
+                break
+        venues += Venue.query.filter(Venue.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
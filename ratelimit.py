@@ -0,0 +1,175 @@
+#----------------------------------------------------------------------------#
+# Token bucket rate limiting.
+#
+# Each (limit name, client ip) pair gets a bucket of `capacity` tokens that
+# refills at capacity/period tokens per second; a request takes one token or
+# is answered with 429 and a Retry-After header. Limits are configured in
+# RATELIMIT_LIMITS as {name: (capacity, period in seconds)} and applied with
+# `@limiter.limit(name)`, or `@ratelimit.limit(name)` in blueprints, which
+# looks up the app's limiter when the request comes in.
+#
+# RATELIMIT_BACKEND picks where buckets live:
+#   'memory' - a dict per worker process (default)
+#   'local'  - a sqlite file shared by every worker on the host
+#----------------------------------------------------------------------------#
+
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import Response, current_app, request
+
+
+def refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend(object):
+
+    # buckets are kept in least recently used order, the oldest are dropped beyond this many keys
+    MAX_KEYS = 100000
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = refill(tokens, updated, capacity, rate, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # forgetting a bucket only ever lets its client in early, never locks anyone out
+            while len(self._buckets) > self.MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class LocalBackend(object):
+
+    # how often each process deletes the buckets that have refilled
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._cleaned = 0
+        conn = self._connect()
+        # `full_at` is when the bucket is full again, from then on it is the same as no bucket
+        conn.execute('CREATE TABLE IF NOT EXISTS token_buckets ('
+                     'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS token_buckets_full_at ON token_buckets (full_at)')
+        # superseded by token_buckets, nothing in it is worth keeping
+        conn.execute('DROP TABLE IF EXISTS buckets')
+
+    def _connect(self):
+        # one connection per thread, and never one inherited across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, now):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM token_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = refill(row[0], row[1], capacity, rate, now) if row else capacity
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO token_buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, now + (capacity - tokens) / rate))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if now - self._cleaned >= self.CLEANUP_INTERVAL:
+            self.cleanup(now)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def cleanup(self, now):
+        self._cleaned = now
+        self._connect().execute('DELETE FROM token_buckets WHERE full_at <= ?', (now,))
+
+
+class RateLimiter(object):
+
+    def __init__(self, app=None):
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        self.limits = app.config.get('RATELIMIT_LIMITS', {})
+        # number of proxies in front of the app that append to X-Forwarded-For (True counts as one)
+        self.trust_proxy = int(app.config.get('RATELIMIT_TRUST_PROXY', 0))
+        backend = app.config.get('RATELIMIT_BACKEND', 'memory')
+        if backend == 'memory':
+            self.backend = MemoryBackend()
+        elif backend == 'local':
+            self.backend = LocalBackend(app.config['RATELIMIT_STORAGE_PATH'])
+        else:
+            raise ValueError('Unknown RATELIMIT_BACKEND {!r}'.format(backend))
+        app.extensions['ratelimit'] = self
+
+    def client_ip(self):
+        # Behind a proxy remote_addr is the proxy. Each trusted proxy appends the address it saw to
+        # X-Forwarded-For, so the client's address is `trust_proxy` entries from the right; anything
+        # further left was sent by the client and can't be trusted
+        route = request.access_route
+        if self.trust_proxy and len(route) >= self.trust_proxy:
+            return route[-self.trust_proxy]
+        return request.remote_addr or 'unknown'
+
+    def check(self, name):
+        # takes a token for the current request, returns the 429 response when there is none left
+        if not self.enabled or name not in self.limits:
+            return None
+        capacity, period = self.limits[name]
+        key = '{}:{}:{}'.format(name, request.endpoint, self.client_ip())
+        allowed, retry_after = self.backend.take(key, capacity, capacity / float(period), time.time())
+        self._count(name, 'allowed' if allowed else 'throttled')
+        if allowed:
+            return None
+        self.app.logger.info('Throttled %s on %s', self.client_ip(), request.endpoint)
+        return Response('Too many requests, please slow down.', 429,
+                        {'Retry-After': str(int(retry_after) + 1)}, mimetype='text/plain')
+
+    def limit(self, name):
+        return _limit(name, lambda: self)
+
+    def _count(self, name, key):
+        with self._stats_lock:
+            self._stats[name][key] += 1
+
+    def stats(self):
+        # {limit name: {'allowed': n, 'throttled': n}}
+        with self._stats_lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
+
+
+def _limit(name, get_limiter):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            throttled = get_limiter().check(name)
+            if throttled is not None:
+                return throttled
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def limit(name):
+    return _limit(name, lambda: current_app.extensions['ratelimit'])
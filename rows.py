@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# Column-projected read paths for the list pages.
+#
+# The `format*` properties on the models load a full ORM instance per row and
+# run several queries per entity. The list pages only need a handful of
+# columns, so these helpers select just those (with upcoming show counts and
+# joined names computed in the same statement) into small __slots__ records.
+# Jinja reads attributes the same way it reads dict keys, so the records go
+# to the templates as they are; `as_dict()` is there for JSON and exports.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Venue, Artist, Show
+
+
+class Record(object):
+    __slots__ = ()
+    # names serialised by as_dict(), properties included
+    fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.fields}
+
+
+class VenueRow(Record):
+    __slots__ = ('id', 'name', 'city', 'state', 'num_upcoming_shows')
+    fields = __slots__
+
+
+class ArtistRow(Record):
+    __slots__ = ('id', 'name', 'num_upcoming_shows')
+    fields = __slots__
+
+
+class AreaRow(Record):
+    __slots__ = ('city', 'state', 'venues')
+    fields = __slots__
+
+    def as_dict(self):
+        return {'city': self.city, 'state': self.state,
+                'venues': [venue.as_dict() for venue in self.venues]}
+
+
+class ShowRow(Record):
+    __slots__ = ('id', 'venue_id', 'venue_name', 'venue_image', 'artist_id', 'artist_name', 'artist_image', 'start_time')
+    fields = ('id', 'venue_id', 'venue_name', 'venue_image_link', 'artist_id', 'artist_name', 'artist_image_link', 'start_time')
+
+    @property
+    def venue_image_link(self):
+        return current_app.extensions['thumbnails'].url(self.venue_image)
+
+    @property
+    def artist_image_link(self):
+        return current_app.extensions['thumbnails'].url(self.artist_image)
+
+
+def upcoming_show_counts(column):
+    # (owner_id, count) of upcoming shows per venue or artist, to outer join against
+    return db.session.query(column.label('owner_id'), func.count(Show.id).label('count')) \
+        .join(Venue, Venue.id == Show.venue_id) \
+        .filter(Show.start_time > datetime.now(), Venue.deleted_at.is_(None)) \
+        .group_by(column) \
+        .subquery()
+
+
+def venue_rows(query=None):
+    counts = upcoming_show_counts(Show.venue_id)
+    query = query if query is not None else db.session.query(Venue)
+    rows = query \
+        .filter(Venue.deleted_at.is_(None)) \
+        .outerjoin(counts, counts.c.owner_id == Venue.id) \
+        .with_entities(Venue.id, Venue.name, Venue.city, Venue.state, func.coalesce(counts.c.count, 0)) \
+        .order_by(Venue.state, Venue.city, Venue.id)
+    return [VenueRow(*row) for row in rows]
+
+
+def venue_areas():
+    # venues grouped per city and state, the shape /venues renders
+    return [AreaRow(city, state, list(venues))
+            for (state, city), venues in groupby(venue_rows(), key=lambda venue: (venue.state, venue.city))]
+
+
+def artist_rows(query=None):
+    counts = upcoming_show_counts(Show.artist_id)
+    query = query if query is not None else db.session.query(Artist)
+    rows = query \
+        .outerjoin(counts, counts.c.owner_id == Artist.id) \
+        .with_entities(Artist.id, Artist.name, func.coalesce(counts.c.count, 0)) \
+        .order_by(Artist.id)
+    return [ArtistRow(*row) for row in rows]
+
+
+def show_rows(query=None):
+    query = query if query is not None else db.session.query(Show)
+    rows = query \
+        .join(Venue, Venue.id == Show.venue_id) \
+        .join(Artist, Artist.id == Show.artist_id) \
+        .filter(Venue.deleted_at.is_(None)) \
+        .with_entities(Show.id, Show.venue_id, Venue.name, Venue.image_link,
+                       Show.artist_id, Artist.name, Artist.image_link, Show.start_time) \
+        .order_by(Show.start_time, Show.id)
+    return [ShowRow(*row) for row in rows]
+
+
+def rows_by_id(model, ids):
+    # venue or artist records for `ids` in that order, from a single query
+    if not ids:
+        return []
+    row_func = venue_rows if model is Venue else artist_rows
+    records = {record.id: record for record in row_func(db.session.query(model).filter(model.id.in_(ids)))}
+    return [records[id] for id in ids if id in records]
@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------#
+# Full text search over the denormalised `search_document` columns.
+#----------------------------------------------------------------------------#
+
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import func
+
+# 'simple' skips stemming and stop words, so names and genres match as typed.
+TEXT_SEARCH_CONFIG = 'simple'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def words(term):
+    # the words a search term is made of, punctuation and whitespace dropped
+    return _WORD_RE.findall((term or '').lower())
+
+
+def prefix_query(term):
+    # "rock n" -> "rock:* & n:*", so partial words keep matching like the old ilike search did
+    parts = words(term)
+    if not parts:
+        return None
+    return ' & '.join(word + ':*' for word in parts)
+
+
+def search(model, term):
+    # Returns [(id, rank)] best match first. Runs on the GIN index of
+    # `model.search_document`, which the database keeps up to date via triggers.
+    query_text = prefix_query(term)
+    # nothing to match on, e.g. "!!", finds nothing rather than everything
+    if query_text is None:
+        return []
+    # models with soft deletes (Venue) only search their live rows
+    query = model.active() if hasattr(model, 'active') else model.query
+    tsquery = func.to_tsquery(TEXT_SEARCH_CONFIG, query_text)
+    rank = func.ts_rank(model.search_document, tsquery)
+    return query \
+        .filter(model.search_document.op('@@')(tsquery)) \
+        .with_entities(model.id, rank) \
+        .order_by(rank.desc(), model.id) \
+        .all()
+
+
+class SearchCache(object):
+    # Short lived per-process cache of search hits, keyed by (kind, normalised term).
+    # Only (id, rank) lists are kept; callers hydrate them with one batched query.
+    # Writes in this process drop the entries of their kind right away, other
+    # workers catch up within SEARCH_CACHE_TTL seconds.
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SEARCH_CACHE_TTL', 30)
+        self.max_entries = app.config.get('SEARCH_CACHE_MAX_ENTRIES', 1024)
+        app.extensions['search_cache'] = self
+
+    @staticmethod
+    def normalise(term):
+        return ' '.join((term or '').casefold().split())
+
+    def search(self, kind, model, term):
+        key = (kind, self.normalise(term))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generations[kind]
+        results = [(id, rank) for id, rank in search(model, key[1])]
+        with self._lock:
+            # a write landed while the query ran, the results may already be stale
+            if generation != self._generations[kind]:
+                return results
+            self._entries[key] = (now + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def invalidate(self, kind):
+        with self._lock:
+            self._generations[kind] += 1
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
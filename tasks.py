@@ -0,0 +1,208 @@
+#----------------------------------------------------------------------------#
+# Background tasks.
+#
+# Work that doesn't have to happen before the response goes out (geocoding,
+# notifications, cache upkeep...) is registered here with `@tasks.task` and
+# queued from the controllers with `tasks.enqueue(name, *args)` once the
+# session has been committed.
+#
+# Backends, picked with TASK_BACKEND:
+#   'thread' - in-process thread pool (default)
+#   'local'  - sqlite file queue on local disk, survives restarts and is
+#              drained by every worker process on the host
+#   'eager'  - runs the task inline, handy from the shell and in tests
+#----------------------------------------------------------------------------#
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadBackend(object):
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # pool threads don't survive a fork, so every process builds its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.queue.workers, thread_name_prefix='task')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def start(self):
+        self._get_executor()
+
+    def submit(self, name, args, kwargs, attempt=0, delay=0):
+        if delay:
+            timer = threading.Timer(delay, self.submit, (name, args, kwargs, attempt))
+            timer.daemon = True
+            timer.start()
+            return
+        self._get_executor().submit(self.queue.run, name, args, kwargs, attempt)
+
+
+class LocalQueueBackend(object):
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, queue, path):
+        self.queue = queue
+        self.path = path
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'payload TEXT NOT NULL, '
+                         'run_at REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.queue.workers):
+                thread = threading.Thread(target=self._drain, name='task-%d' % i)
+                thread.daemon = True
+                thread.start()
+
+    def submit(self, name, args, kwargs, attempt=0, delay=0):
+        payload = json.dumps({'name': name, 'args': args, 'kwargs': kwargs, 'attempt': attempt})
+        with self._connect() as conn:
+            conn.execute('INSERT INTO tasks (payload, run_at) VALUES (?, ?)',
+                         (payload, time.time() + delay))
+        self.start()
+        self._wakeup.set()
+
+    def _claim(self, conn):
+        # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same row
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT id, payload FROM tasks WHERE run_at <= ? '
+                               'ORDER BY run_at, id LIMIT 1', (time.time(),)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM tasks WHERE id = ?', (row[0],))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return json.loads(row[1]) if row else None
+
+    def _drain(self):
+        conn = self._connect()
+        while True:
+            try:
+                task = self._claim(conn)
+            except sqlite3.OperationalError:
+                logger.exception('Could not read the local task queue')
+                task = None
+            if task is None:
+                self._wakeup.wait(self.POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self.queue.run(task['name'], task['args'], task['kwargs'], task['attempt'])
+
+
+class EagerBackend(object):
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def start(self):
+        pass
+
+    def submit(self, name, args, kwargs, attempt=0, delay=0):
+        self.queue.run(name, args, kwargs, attempt)
+
+
+class TaskQueue(object):
+
+    def __init__(self, app=None):
+        self.registry = {}
+        self.app = None
+        self.backend = None
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('TASK_WORKERS', 4)
+        self.max_retries = app.config.get('TASK_MAX_RETRIES', 3)
+        self.retry_backoff = app.config.get('TASK_RETRY_BACKOFF', 0.5)
+        backend = app.config.get('TASK_BACKEND', 'thread')
+        if backend == 'thread':
+            self.backend = ThreadBackend(self)
+        elif backend == 'local':
+            self.backend = LocalQueueBackend(self, app.config['TASK_QUEUE_PATH'])
+        elif backend == 'eager':
+            self.backend = EagerBackend(self)
+        else:
+            raise ValueError('Unknown TASK_BACKEND {!r}'.format(backend))
+        app.extensions['tasks'] = self
+        # workers are started once per process, i.e. after gunicorn has forked; start() only compares
+        # the pid once they run, and enqueueing starts them too
+        app.before_request(self.backend.start)
+
+    def task(self, name=None, max_retries=None):
+        def decorator(func):
+            self.registry[name or func.__name__] = (func, max_retries)
+            return func
+        return decorator
+
+    def enqueue(self, name, *args, **kwargs):
+        if name not in self.registry:
+            raise KeyError('No task registered as {!r}'.format(name))
+        self._count(name, 'enqueued')
+        self.backend.submit(name, list(args), kwargs)
+
+    def run(self, name, args, kwargs, attempt=0):
+        func, max_retries = self.registry[name]
+        if max_retries is None:
+            max_retries = self.max_retries
+        started = time.time()
+        try:
+            with self.app.app_context():
+                func(*args, **kwargs)
+        except Exception:
+            if attempt < max_retries:
+                self._count(name, 'retried')
+                logger.warning('Task %s failed, retrying (attempt %d of %d)', name, attempt + 1, max_retries, exc_info=True)
+                self.backend.submit(name, args, kwargs, attempt + 1, delay=self.retry_backoff * 2 ** attempt)
+            else:
+                self._count(name, 'failed')
+                logger.exception('Task %s failed after %d attempts', name, attempt + 1)
+        else:
+            self._count(name, 'succeeded')
+        finally:
+            self._count(name, 'seconds', time.time() - started)
+
+    def _count(self, name, key, value=1):
+        with self._stats_lock:
+            self._stats[name][key] += value
+
+    def stats(self):
+        # {task name: {'enqueued': n, 'succeeded': n, 'retried': n, 'failed': n, 'seconds': total}}
+        with self._stats_lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
@@ -0,0 +1,21 @@
+#----------------------------------------------------------------------------#
+# Shared fixtures. Run the suite from the project root with `python -m pytest`.
+#----------------------------------------------------------------------------#
+
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_app():
+    # a bare app with just the given settings, for testing one extension at a time
+    def make(**config):
+        app = Flask(__name__)
+        app.config.update(SECRET_KEY='test', TESTING=True, **config)
+        return app
+    return make
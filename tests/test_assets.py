@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+
+import pytest
+from flask import Flask, url_for
+
+import assets
+from assets import Assets
+
+CSS = b'body { color: #333; }\n' * 50
+
+
+@pytest.fixture
+def static(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'css' / 'main.css').write_bytes(CSS)
+    (static / 'img').mkdir()
+    (static / 'img' / 'logo.png').write_bytes(b'\x89PNG not really')
+    return static
+
+
+def make_app(static, **config):
+    app = Flask(__name__, static_folder=str(static))
+    app.config.update(SECRET_KEY='test', TESTING=True, **config)
+    Assets(app)
+    return app
+
+
+def url_for_static(app, filename):
+    with app.test_request_context():
+        return url_for('static', filename=filename)
+
+
+def test_build_fingerprints_and_precompresses_text(static):
+    manifest = assets.build(str(static))
+    css, png = manifest['css/main.css'], manifest['img/logo.png']
+    assert css.startswith('dist/css/main.') and css.endswith('.css')
+    assert png.startswith('dist/img/logo.') and png.endswith('.png')
+    assert (static / css).read_bytes() == CSS
+    assert gzip.decompress((static / (css + '.gz')).read_bytes()) == CSS
+    assert not os.path.exists(str(static / (png + '.gz')))
+    assert json.loads((static / 'dist' / 'manifest.json').read_text()) == manifest
+
+    # the hash follows the content, and a rebuild doesn't fingerprint its own output
+    (static / 'css' / 'main.css').write_bytes(CSS + b'a { }\n')
+    rebuilt = assets.build(str(static))
+    assert sorted(rebuilt) == ['css/main.css', 'img/logo.png']
+    assert rebuilt['css/main.css'] != css
+    assert rebuilt['img/logo.png'] == png
+
+
+def test_static_urls_point_at_fingerprinted_files(static):
+    assert url_for_static(make_app(static), 'css/main.css') == '/static/css/main.css'
+    manifest = assets.build(str(static))
+    app = make_app(static)
+    assert url_for_static(app, 'css/main.css') == '/static/' + manifest['css/main.css']
+    assert url_for_static(app, 'missing.css') == '/static/missing.css'
+
+
+def test_fingerprinted_files_are_immutable_and_precompressed(static):
+    manifest = assets.build(str(static))
+    client = make_app(static).test_client()
+    response = client.get('/static/' + manifest['css/main.css'], headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == assets.IMMUTABLE
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.get_data()) == CSS
+
+    response = client.get('/static/' + manifest['css/main.css'])
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == CSS
+
+    response = client.get('/static/css/main.css')
+    assert response.status_code == 200
+    assert response.headers.get('Cache-Control') != assets.IMMUTABLE
+
+
+@pytest.mark.parametrize('body, accept, compressed', [
+    ('<p>hello</p>' * 100, 'gzip, deflate', True),
+    ('<p>hello</p>' * 100, '', False),
+    ('<p>hi</p>', 'gzip', False),
+])
+def test_html_responses_are_compressed(static, body, accept, compressed):
+    app = make_app(static)
+    app.add_url_rule('/', 'index', lambda: body)
+    response = app.test_client().get('/', headers={'Accept-Encoding': accept})
+    assert ('Content-Encoding' in response.headers) == compressed
+    data = response.get_data()
+    assert (gzip.decompress(data) if compressed else data) == body.encode()
+
+
+def test_other_mimetypes_are_left_alone(static):
+    app = make_app(static)
+    app.add_url_rule('/data', 'data', lambda: {'hello': 'x' * 1000})
+    response = app.test_client().get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,73 @@
+#----------------------------------------------------------------------------#
+# Needs a Postgres database of its own, its tables are created and dropped:
+#
+#   TEST_DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest
+#----------------------------------------------------------------------------#
+
+import os
+import warnings
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import SAWarning
+
+from models import Artist, Show, Venue, compact_deleted_venues, db
+
+pytestmark = pytest.mark.skipif(not os.environ.get('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+
+# shows per venue, the batch sizes below sit around it
+SHOWS = 4
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SQLALCHEMY_DATABASE_URI=os.environ.get('TEST_DATABASE_URL'),
+                   SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def venues(app):
+    # two soft deleted venues and a live one, each with SHOWS shows
+    artist = Artist(name='Guns N Petals')
+    db.session.add(artist)
+    venues = [Venue(name=name, city='San Francisco', state='CA') for name in ('Gone', 'Also gone', 'Live')]
+    db.session.add_all(venues)
+    db.session.flush()
+    for venue in venues:
+        for day in range(SHOWS):
+            db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime(2035, 4, 1 + day)))
+    venues[0].deleted_at = venues[1].deleted_at = datetime.utcnow()
+    db.session.commit()
+    return [venue.id for venue in venues]
+
+
+@pytest.mark.parametrize('batch_size', [1, SHOWS - 1, SHOWS, SHOWS + 1, 2 * SHOWS, 1000])
+def test_removes_deleted_venues_and_their_shows(venues, batch_size):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', SAWarning)
+        assert compact_deleted_venues(batch_size) == (2, 2 * SHOWS)
+    gone, also_gone, live = venues
+    assert [venue.id for venue in Venue.query.all()] == [live]
+    assert Show.query.filter(Show.venue_id == live).count() == SHOWS
+    assert Show.query.count() == SHOWS
+
+
+def test_only_venues_deleted_before_the_cutoff(venues):
+    gone, also_gone, live = venues
+    Venue.query.filter(Venue.id == also_gone).update({'deleted_at': datetime.utcnow() + timedelta(days=1)})
+    db.session.commit()
+    assert compact_deleted_venues(before=datetime.utcnow() + timedelta(hours=1)) == (1, SHOWS)
+    assert sorted(venue.id for venue in Venue.query.all()) == [also_gone, live]
+
+
+def test_active_shows_skip_deleted_venues(venues):
+    gone, also_gone, live = venues
+    assert Show.query.count() == 3 * SHOWS
+    assert {show.venue_id for show in Show.active()} == {live}
+    assert [venue.id for venue in Venue.active()] == [live]
@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Needs a Postgres database of its own, its tables are created and dropped:
+#
+#   TEST_DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import os
+from datetime import datetime
+
+import pytest
+
+import export
+from models import Artist, Show, Venue, db
+
+pytestmark = pytest.mark.skipif(not os.environ.get('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SQLALCHEMY_DATABASE_URI=os.environ.get('TEST_DATABASE_URL'),
+                   SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def shows(app):
+    # five shows at a live venue, one at a soft deleted venue that exports leave out
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', seeking_venue=True)
+    live = Venue(name='The Musical Hop', city='San Francisco', state='CA', latitude=37.77, longitude=-122.41)
+    gone = Venue(name='Gone', city='Oakland', state='CA', deleted_at=datetime.utcnow())
+    db.session.add_all([artist, live, gone])
+    db.session.flush()
+    for day in range(1, 6):
+        db.session.add(Show(venue_id=live.id, artist_id=artist.id, start_time=datetime(2035, 4, day, 20)))
+    db.session.add(Show(venue_id=gone.id, artist_id=artist.id, start_time=datetime(2035, 4, 1, 20)))
+    db.session.commit()
+
+
+def test_csv_is_streamed_in_chunks_with_one_header(shows):
+    pieces = list(export.iter_csv('shows', chunk_size=2))
+    assert len(pieces) == 3
+    assert pieces[0].startswith('id,start_time,venue_id,venue_name,artist_id,artist_name\r\n')
+    assert not any(piece.startswith('id,') for piece in pieces[1:])
+    rows = list(csv.DictReader(io.StringIO(''.join(pieces))))
+    assert [row['id'] for row in rows] == ['1', '2', '3', '4', '5']
+    assert {row['venue_name'] for row in rows} == {'The Musical Hop'}
+
+
+def test_csv_without_rows_is_just_the_header(app):
+    assert list(export.iter_csv('venues')) == [','.join(column.key for column in export._venue_columns()) + '\r\n']
+
+
+def test_csv_file_counts_rows(shows, tmp_path):
+    path = str(tmp_path / 'venues.csv')
+    assert export.write('venues', 'csv', path, chunk_size=1) == 1
+    with open(path) as f:
+        assert [row['name'] for row in csv.DictReader(f)] == ['The Musical Hop']
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_columnar_schema_and_rows(shows, tmp_path, fmt):
+    pa = pytest.importorskip('pyarrow')
+    path = str(tmp_path / ('shows.' + fmt))
+    assert export.write('shows', fmt, path, chunk_size=2) == 5
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+    else:
+        table = pa.ipc.open_file(path).read_all()
+    assert [(field.name, field.type) for field in table.schema] == [
+        ('id', pa.int64()), ('start_time', pa.timestamp('us')), ('venue_id', pa.int64()),
+        ('venue_name', pa.string()), ('artist_id', pa.int64()), ('artist_name', pa.string()),
+    ]
+    assert table.column('id').to_pylist() == [1, 2, 3, 4, 5]
+    assert table.column('start_time').to_pylist()[0] == datetime(2035, 4, 1, 20)
+
+
+def test_venue_schema_types(app):
+    pa = pytest.importorskip('pyarrow')
+    schema = export._arrow_schema('venues')
+    assert schema.field('seeking_talent').type == pa.bool_()
+    assert schema.field('latitude').type == pa.float64()
+    assert schema.field('name').type == pa.string()
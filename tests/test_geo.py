@@ -0,0 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import geo
+
+
+def test_concurrent_first_lookups_see_both_tables(monkeypatch):
+    monkeypatch.setattr(geo, '_by_city', None)
+    monkeypatch.setattr(geo, '_by_zip', None)
+    with ThreadPoolExecutor(8) as pool:
+        points = list(pool.map(lambda i: geo.geocode('San Francisco', 'CA'), range(32)))
+    assert None not in points
+    assert len(set(points)) == 1
+
+
+def test_a_zip_code_wins_over_the_city():
+    assert geo.geocode('San Francisco', 'CA', '1015 Folsom Street, 94103') != geo.geocode('San Francisco', 'CA')
+    assert geo.geocode('Saint Louis', 'MO') == geo.geocode('St. Louis', 'mo')
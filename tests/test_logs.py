@@ -0,0 +1,34 @@
+import json
+
+from flask.logging import default_handler
+
+import logs
+from logs import RequestLog
+
+
+def read(path):
+    # stopping the listeners flushes what is still queued
+    logs._stop()
+    with open(str(path)) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_apps_sharing_the_loggers_write_every_line_once(make_app, tmp_path):
+    apps = [make_app(LOG_DIR=str(tmp_path)) for i in range(2)]
+    for app in apps:
+        RequestLog(app)
+        app.add_url_rule('/', 'index', lambda: 'ok')
+    for app in apps:
+        app.test_client().get('/', headers={'X-Request-ID': 'req-1'})
+    apps[0].logger.info('hello')
+
+    access = read(tmp_path / 'access.log')
+    assert [(line['endpoint'], line['status'], line['request_id']) for line in access] == [('index', 200, 'req-1')] * 2
+    errors = read(tmp_path / 'error.log')
+    assert [line['message'] for line in errors] == ['hello']
+
+
+def test_nothing_is_written_on_the_request_thread(make_app, tmp_path):
+    app = make_app(LOG_DIR=str(tmp_path))
+    RequestLog(app)
+    assert default_handler not in app.logger.handlers
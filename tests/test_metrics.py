@@ -0,0 +1,143 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from metrics import Metrics
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+def snapshot(directory, pid, queries, pool_size, buckets):
+    path = os.path.join(str(directory), '{}-1.json'.format(pid))
+    with open(path, 'w') as f:
+        json.dump({
+            'fyyur_db_queries_total': {'type': 'counter', 'help': 'q', 'labelnames': [], 'buckets': [],
+                                       'samples': [[[], queries]]},
+            'fyyur_db_pool_connections': {'type': 'gauge', 'help': 'p', 'labelnames': ['state'], 'buckets': [],
+                                          'samples': [[['size'], pool_size]]},
+            'worker_seconds': {'type': 'histogram', 'help': 'd', 'labelnames': [],
+                               'buckets': [0.1], 'samples': [[[], [buckets, 1.0, sum(buckets)]]]},
+        }, f)
+    return path
+
+
+def lines(metrics, *names):
+    return [line for line in metrics.render().splitlines() if line.startswith(names)]
+
+
+@pytest.fixture
+def metrics(make_app):
+    return Metrics(make_app(METRICS_TOKEN='s3cret'))
+
+
+def test_render(metrics):
+    requests = metrics.counter('requests_total', 'Requests.', ('path',))
+    requests.inc(path='/a "b"')
+    requests.inc(2, path='/a "b"')
+    latency = metrics.histogram('latency_seconds', 'Latency.', (), (0.1, 1))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    text = metrics.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{path="/a \\"b\\""} 3' in text
+    assert lines(metrics, 'latency_seconds') == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_counts_requests_per_endpoint(make_app):
+    app = make_app(METRICS_TOKEN='s3cret')
+    metrics = Metrics(app)
+    app.add_url_rule('/hello', 'hello', lambda: 'hi')
+    client = app.test_client()
+    client.get('/hello')
+    client.get('/hello')
+    client.get('/nowhere')
+    assert lines(metrics, 'fyyur_http_requests_total') == [
+        'fyyur_http_requests_total{endpoint="hello",method="GET",status="200"} 2',
+        'fyyur_http_requests_total{endpoint="unmatched",method="GET",status="404"} 1',
+    ]
+
+
+def test_statements_count_for_the_app_running_them(make_app):
+    first, second = make_app(), make_app()
+    Metrics(first)
+    Metrics(second)
+    engine = create_engine('sqlite://')
+    with first.app_context(), engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+        conn.execute(text('SELECT 2'))
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 3'))
+    assert lines(first.extensions['metrics'], 'fyyur_db_queries_total') == ['fyyur_db_queries_total 2']
+    assert lines(second.extensions['metrics'], 'fyyur_db_queries_total') == []
+
+
+def test_scrapes_need_the_token(make_app):
+    client = Metrics(make_app()).app.test_client()
+    assert client.get('/metrics').status_code == 404
+
+    app = make_app(METRICS_TOKEN='s3cret')
+    Metrics(app)
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+
+
+def test_aggregates_worker_snapshots(metrics, tmp_path):
+    metrics.directory = str(tmp_path)
+    snapshot(tmp_path, os.getppid(), 10, 5, [1, 0])
+    snapshot(tmp_path, dead_pid(), 100, 7, [0, 2])
+    # this process's own snapshot counts too, its gauges are unset
+    assert lines(metrics, 'fyyur_db_queries_total', 'fyyur_db_pool', 'worker_seconds_count') == [
+        'fyyur_db_pool_connections{state="size"} 5',
+        'fyyur_db_queries_total 110',
+        'worker_seconds_count 3',
+    ]
+
+
+def test_retire_folds_a_dead_worker_into_one_file(metrics, tmp_path):
+    metrics.directory = str(tmp_path)
+    first, second = dead_pid(), dead_pid()
+    snapshot(tmp_path, first, 100, 7, [0, 2])
+    snapshot(tmp_path, second, 1, 7, [1, 0])
+    before = lines(metrics, 'fyyur_db_queries_total', 'fyyur_db_pool', 'worker_seconds')
+
+    metrics.retire(first)
+    metrics.retire(second)
+    assert sorted(name for name in os.listdir(str(tmp_path)) if not name.startswith(str(os.getpid()))) == \
+        ['retired.json']
+    assert lines(metrics, 'fyyur_db_queries_total', 'fyyur_db_pool', 'worker_seconds') == before
+    assert 'fyyur_db_queries_total 101' in before
+
+
+def test_a_worker_retired_mid_scrape_counts_once(metrics, tmp_path):
+    metrics.directory = str(tmp_path)
+    pid = dead_pid()
+    snapshot(tmp_path, pid, 100, 7, [0, 2])
+    load_retired = metrics._load_retired
+
+    # the master folds the snapshot after the scrape has read it but before it reads retired.json
+    def retire_first():
+        metrics._load_retired = load_retired
+        metrics.retire(pid)
+        return load_retired()
+    metrics._load_retired = retire_first
+    assert 'fyyur_db_queries_total 100' in lines(metrics, 'fyyur_db_queries_total')
+    assert 'fyyur_db_queries_total 100' in lines(metrics, 'fyyur_db_queries_total')
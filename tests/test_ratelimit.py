@@ -0,0 +1,81 @@
+import pytest
+
+import ratelimit
+from ratelimit import LocalBackend, MemoryBackend, RateLimiter, refill
+
+
+def test_refill_is_capped_at_capacity():
+    assert refill(0, 0, 5, 1, 2) == 2
+    assert refill(4, 0, 5, 1, 10) == 5
+
+
+@pytest.fixture(params=['memory', 'local'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return LocalBackend(str(tmp_path / 'ratelimit.sqlite3'))
+
+
+def test_token_bucket(backend):
+    # two requests right away, then one a second
+    assert backend.take('k', 2, 1.0, 100.0) == (True, 0)
+    assert backend.take('k', 2, 1.0, 100.0) == (True, 0)
+    allowed, retry_after = backend.take('k', 2, 1.0, 100.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+    assert backend.take('k', 2, 1.0, 101.0) == (True, 0)
+    # buckets are per key
+    assert backend.take('other', 2, 1.0, 101.0) == (True, 0)
+
+
+def test_memory_backend_drops_least_recently_used_buckets(monkeypatch):
+    monkeypatch.setattr(MemoryBackend, 'MAX_KEYS', 2)
+    backend = MemoryBackend()
+    backend.take('a', 2, 1.0, 0.0)
+    backend.take('b', 2, 1.0, 0.0)
+    backend.take('a', 2, 1.0, 1.0)
+    backend.take('c', 2, 1.0, 2.0)
+    assert list(backend._buckets) == ['a', 'c']
+
+
+def test_local_backend_deletes_refilled_buckets(monkeypatch, tmp_path):
+    backend = LocalBackend(str(tmp_path / 'ratelimit.sqlite3'))
+    backend.take('a', 2, 1.0, 0.0)
+    backend.take('b', 2, 1.0, 5.0)
+    monkeypatch.setattr(backend, 'CLEANUP_INTERVAL', 0)
+    # 'a' is full again one second after it was taken from, 'b' only just lost a token
+    backend.take('b', 2, 1.0, 5.5)
+    rows = backend._connect().execute('SELECT key FROM token_buckets').fetchall()
+    assert rows == [('b',)]
+
+
+@pytest.mark.parametrize('trust_proxy, forwarded, expected', [
+    (0, 'spoofed, 203.0.113.7', '10.0.0.1'),
+    (1, 'spoofed, 203.0.113.7', '203.0.113.7'),
+    (2, 'spoofed, 203.0.113.7', 'spoofed'),
+    (2, '203.0.113.7', '10.0.0.1'),
+])
+def test_client_ip_counts_trusted_proxies_from_the_right(make_app, trust_proxy, forwarded, expected):
+    app = make_app(RATELIMIT_TRUST_PROXY=trust_proxy)
+    limiter = RateLimiter(app)
+    with app.test_request_context(headers={'X-Forwarded-For': forwarded},
+                                  environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert limiter.client_ip() == expected
+
+
+def test_limit_answers_429_once_the_bucket_is_empty(make_app):
+    app = make_app(RATELIMIT_LIMITS={'search': (1, 60)})
+    limiter = RateLimiter(app)
+
+    @app.route('/search')
+    @ratelimit.limit('search')
+    def search():
+        return 'ok'
+
+    client = app.test_client()
+    assert client.get('/search').status_code == 200
+    response = client.get('/search')
+    assert response.status_code == 429
+    # a full token takes 60s, less whatever passed since the first request
+    assert response.headers['Retry-After'] in ('60', '61')
+    assert limiter.stats() == {'search': {'allowed': 1, 'throttled': 1}}
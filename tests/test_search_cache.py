@@ -0,0 +1,74 @@
+import pytest
+
+import search
+from search import SearchCache
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    # stands in for the database: records every query and answers with one hit per call
+    calls = []
+
+    def fake_search(model, term):
+        calls.append((model, term))
+        return [(len(calls), 1.0)]
+    monkeypatch.setattr(search, 'search', fake_search)
+    return calls
+
+
+@pytest.fixture
+def cache(make_app):
+    return SearchCache(make_app(SEARCH_CACHE_TTL=30, SEARCH_CACHE_MAX_ENTRIES=2))
+
+
+def test_repeated_terms_are_served_from_the_cache(cache, queries):
+    assert cache.search('venue', 'Venue', 'Jazz') == [(1, 1.0)]
+    # the term is normalised before lookup
+    assert cache.search('venue', 'Venue', '  jazz ') == [(1, 1.0)]
+    assert len(queries) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+
+
+def test_invalidate_drops_only_its_kind(cache, queries):
+    cache.search('venue', 'Venue', 'jazz')
+    cache.search('artist', 'Artist', 'jazz')
+    cache.invalidate('venue')
+    cache.search('venue', 'Venue', 'jazz')
+    cache.search('artist', 'Artist', 'jazz')
+    assert queries == [('Venue', 'jazz'), ('Artist', 'jazz'), ('Venue', 'jazz')]
+
+
+def test_results_of_a_query_raced_by_a_write_are_not_cached(cache, monkeypatch):
+    calls = []
+
+    def racing_search(model, term):
+        calls.append(term)
+        if len(calls) == 1:
+            # a venue is saved while the first query is still running
+            cache.invalidate('venue')
+        return [(len(calls), 1.0)]
+    monkeypatch.setattr(search, 'search', racing_search)
+
+    assert cache.search('venue', 'Venue', 'jazz') == [(1, 1.0)]
+    assert cache.stats()['entries'] == 0
+    assert cache.search('venue', 'Venue', 'jazz') == [(2, 1.0)]
+    assert cache.search('venue', 'Venue', 'jazz') == [(2, 1.0)]
+    assert len(calls) == 2
+
+
+def test_least_recently_used_terms_are_evicted(cache, queries):
+    cache.search('venue', 'Venue', 'a')
+    cache.search('venue', 'Venue', 'b')
+    cache.search('venue', 'Venue', 'a')
+    cache.search('venue', 'Venue', 'c')
+    assert cache.stats()['entries'] == 2
+    cache.search('venue', 'Venue', 'a')
+    cache.search('venue', 'Venue', 'b')
+    assert [term for model, term in queries] == ['a', 'b', 'c', 'b']
+
+
+def test_expired_entries_are_queried_again(make_app, queries):
+    cache = SearchCache(make_app(SEARCH_CACHE_TTL=-1))
+    cache.search('venue', 'Venue', 'jazz')
+    cache.search('venue', 'Venue', 'jazz')
+    assert len(queries) == 2
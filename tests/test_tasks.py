@@ -0,0 +1,27 @@
+import os
+
+from tasks import TaskQueue
+
+
+def test_workers_start_with_the_first_request(make_app):
+    app = make_app(TASK_BACKEND='thread')
+    queue = TaskQueue(app)
+    app.add_url_rule('/', 'index', lambda: 'ok')
+    assert queue.backend._pid is None
+    assert app.test_client().get('/').status_code == 200
+    assert queue.backend._pid == os.getpid()
+
+
+def test_failing_tasks_are_retried_then_given_up(make_app):
+    queue = TaskQueue(make_app(TASK_BACKEND='eager', TASK_MAX_RETRIES=2, TASK_RETRY_BACKOFF=0))
+    calls = []
+
+    @queue.task()
+    def flaky(value):
+        calls.append(value)
+        raise ValueError(value)
+
+    queue.enqueue('flaky', 1)
+    assert calls == [1, 1, 1]
+    stats = queue.stats()['flaky']
+    assert (stats['enqueued'], stats['retried'], stats['failed']) == (1, 2, 1)
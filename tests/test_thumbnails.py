@@ -0,0 +1,73 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from thumbnails import ThumbnailCache, Thumbnails
+
+
+@pytest.fixture
+def app(make_app, tmp_path):
+    (tmp_path / 'src').mkdir()
+    image = Image.new('RGBA', (200, 100), (255, 0, 0, 255))
+    image.save(str(tmp_path / 'src' / 'band.png'))
+    app = make_app(THUMBNAIL_SOURCE='file', THUMBNAIL_SOURCE_ROOT=str(tmp_path / 'src'),
+                   THUMBNAIL_CACHE_DIR=str(tmp_path / 'cache'), THUMBNAIL_SIZES={'small': (32, 32)})
+    Thumbnails(app)
+    return app
+
+
+def thumbnail_url(app, src, size='small'):
+    with app.test_request_context():
+        return app.extensions['thumbnails'].url(src, size)
+
+
+def test_fetches_resizes_and_caches(app, tmp_path):
+    url = thumbnail_url(app, 'http://images.example.com/band.png')
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.cache_control.max_age == 7 * 24 * 60 * 60
+    image = Image.open(io.BytesIO(response.get_data()))
+    assert image.format == 'JPEG'
+    assert image.size == (32, 16)
+
+    # served from the cache once built, the source isn't needed any more
+    os.remove(str(tmp_path / 'src' / 'band.png'))
+    assert client.get(url).status_code == 200
+
+
+def test_url_is_memoised_per_src_and_size(app):
+    first = thumbnail_url(app, 'http://images.example.com/band.png')
+    assert thumbnail_url(app, 'http://images.example.com/band.png') is first
+    assert thumbnail_url(app, 'http://images.example.com/band.png', 'large') != first
+
+
+def test_rejects_unsigned_and_unknown_sizes(app):
+    client = app.test_client()
+    url = thumbnail_url(app, 'http://images.example.com/band.png')
+    assert client.get(url.replace('sig=', 'sig=0')).status_code == 403
+    assert client.get(url.replace('/small', '/huge')).status_code == 404
+
+
+def test_redirects_to_the_original_when_it_cant_be_fetched(app):
+    response = app.test_client().get(thumbnail_url(app, 'http://images.example.com/missing.png'))
+    assert response.status_code == 302
+    assert response.headers['Location'] == 'http://images.example.com/missing.png'
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=250)
+    a = cache.put('aa' * 32, b'a' * 100)
+    b = cache.put('bb' * 32, b'b' * 100)
+    os.utime(a, (1000, 1000))
+    os.utime(b, (2000, 2000))
+    # reading `a` makes `b` the least recently used
+    assert cache.get('aa' * 32) == a
+    cache.put('cc' * 32, b'c' * 100)
+    assert cache.get('bb' * 32) is None
+    assert cache.get('aa' * 32) == a
+    assert cache.get('cc' * 32) is not None
+    assert cache._size == 200
@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------#
+# Needs a Postgres database of its own, its tables are created and dropped:
+#
+#   TEST_DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest
+#----------------------------------------------------------------------------#
+
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from models import Artist, Venue, db, update_versioned
+
+pytestmark = pytest.mark.skipif(not os.environ.get('TEST_DATABASE_URL'), reason='TEST_DATABASE_URL is not set')
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SQLALCHEMY_DATABASE_URI=os.environ.get('TEST_DATABASE_URL'),
+                   SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def venue_id(app):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA')
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def current(venue_id):
+    db.session.expire_all()
+    return Venue.query.get(venue_id)
+
+
+def test_writes_changed_columns_and_bumps_the_version(venue_id):
+    changed = update_versioned(Venue, venue_id, 1, {'name': 'The Musical Hop', 'city': 'Oakland'})
+    db.session.commit()
+    assert changed == ['city']
+    venue = current(venue_id)
+    assert (venue.city, venue.version) == ('Oakland', 2)
+
+
+def test_nothing_changed_leaves_the_version_alone(venue_id):
+    assert update_versioned(Venue, venue_id, 1, {'name': 'The Musical Hop'}) == []
+    db.session.commit()
+    assert current(venue_id).version == 1
+
+
+def test_stale_version_is_a_conflict(venue_id):
+    assert update_versioned(Venue, venue_id, 1, {'city': 'Oakland'}) == ['city']
+    db.session.commit()
+    assert update_versioned(Venue, venue_id, 1, {'city': 'Berkeley'}) is None
+    db.session.rollback()
+    assert current(venue_id).city == 'Oakland'
+
+
+def test_edit_landing_between_read_and_update_is_a_conflict(app, venue_id):
+    # another request commits its edit right before this one's UPDATE runs
+    edited = []
+
+    def concurrent_edit(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE') and not edited:
+            edited.append(True)
+            with db.engine.begin() as other:
+                other.execute(Venue.__table__.update().where(Venue.id == venue_id)
+                              .values(city='Berkeley', version=Venue.version + 1))
+    event.listen(db.engine, 'before_cursor_execute', concurrent_edit)
+    try:
+        assert update_versioned(Venue, venue_id, None, {'city': 'Oakland'}) is None
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', concurrent_edit)
+    db.session.rollback()
+    venue = current(venue_id)
+    assert (venue.city, venue.version) == ('Berkeley', 2)
+
+
+def test_soft_deleted_venues_are_not_updated(venue_id):
+    Venue.query.filter(Venue.id == venue_id).update({'deleted_at': datetime.utcnow()})
+    db.session.commit()
+    assert update_versioned(Venue, venue_id, 1, {'city': 'Oakland'}) is None
+    db.session.rollback()
+    assert current(venue_id).city == 'San Francisco'
+
+
+def test_models_without_soft_deletes(app):
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA')
+    db.session.add(artist)
+    db.session.commit()
+    assert update_versioned(Artist, artist.id, 1, {'city': 'Oakland'}) == ['city']
+    db.session.commit()
+    assert update_versioned(Artist, 12345, None, {'city': 'Oakland'}) is None
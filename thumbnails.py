@@ -0,0 +1,185 @@
+#----------------------------------------------------------------------------#
+# Image thumbnails.
+#
+# `image_link` values point at arbitrary full size remote images. Templates
+# go through `thumbnails.url(image_link, size)` (or the `thumbnail` Jinja
+# filter) instead, which points at /thumbnails/<size>. That endpoint fetches
+# the original once from the configured source, resizes it and keeps the
+# result in an on-disk cache addressed by the hash of (source url, size).
+# The cache is capped at THUMBNAIL_CACHE_MAX_BYTES and evicts the least
+# recently used files first.
+#
+# Source URLs are signed with SECRET_KEY so the endpoint can't be used as an
+# open proxy.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import hmac
+import io
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from flask import abort, has_request_context, redirect, request, send_file, url_for
+
+DEFAULT_SIZES = {
+    'small': (64, 64),
+    'medium': (300, 300),
+    'large': (800, 800),
+}
+
+
+class HTTPSource(object):
+
+    def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+
+    def fetch(self, src):
+        if urlparse(src).scheme not in ('http', 'https'):
+            raise ValueError('Unsupported image url {!r}'.format(src))
+        with urlopen(src, timeout=self.timeout) as response:
+            data = response.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            raise ValueError('Image at {!r} is larger than {} bytes'.format(src, self.max_bytes))
+        return data
+
+
+class FileSource(object):
+    # Local stand-in for HTTPSource: serves the url's file name out of `root`.
+
+    def __init__(self, root):
+        self.root = root
+
+    def fetch(self, src):
+        name = os.path.basename(urlparse(src).path)
+        if not name:
+            raise ValueError('Unsupported image url {!r}'.format(src))
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+
+class ThumbnailCache(object):
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path, mtime in self._files())
+
+    def _files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.startswith('.'):
+                    path = os.path.join(root, name)
+                    yield path, os.path.getmtime(path)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            # mtime doubles as the last access time for LRU eviction
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename, so readers never see half a thumbnail
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        # other workers share the directory, so start from what is really on disk
+        files = sorted(self._files(), key=lambda item: item[1])
+        self._size = sum(os.path.getsize(path) for path, mtime in files)
+        target = self.max_bytes * 0.9
+        for path, mtime in files:
+            if self._size <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+class Thumbnails(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.sizes = app.config.get('THUMBNAIL_SIZES', DEFAULT_SIZES)
+        if app.config.get('THUMBNAIL_SOURCE', 'http') == 'file':
+            self.source = FileSource(app.config['THUMBNAIL_SOURCE_ROOT'])
+        else:
+            self.source = HTTPSource(timeout=app.config.get('THUMBNAIL_FETCH_TIMEOUT', 5))
+        self.cache = ThumbnailCache(app.config['THUMBNAIL_CACHE_DIR'],
+                                    app.config.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        # list pages link the same few images over and over, url_for and the HMAC run once per (src, size)
+        self._cached_url = lru_cache(maxsize=app.config.get('THUMBNAIL_URL_CACHE_SIZE', 16384))(self._build_url)
+        app.add_url_rule('/thumbnails/<size>', 'thumbnail', self.serve)
+        app.jinja_env.filters['thumbnail'] = self.url
+        app.extensions['thumbnails'] = self
+
+    def _sign(self, src):
+        secret = self.app.config['SECRET_KEY']
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        return hmac.new(secret, src.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+    def url(self, src, size='medium'):
+        if not src:
+            return src
+        # outside a request url_for builds external urls, so those are cached apart
+        script_root = request.script_root if has_request_context() else None
+        return self._cached_url(script_root, src, size)
+
+    def _build_url(self, script_root, src, size):
+        return url_for('thumbnail', size=size, src=src, sig=self._sign(src))
+
+    def serve(self, size):
+        src = request.args.get('src', '')
+        if size not in self.sizes or not src:
+            abort(404)
+        if not hmac.compare_digest(request.args.get('sig', ''), self._sign(src)):
+            abort(403)
+        key = hashlib.sha256('{}\n{}'.format(size, src).encode('utf-8')).hexdigest()
+        path = self.cache.get(key)
+        if path is None:
+            try:
+                path = self.cache.put(key, self.render(self.source.fetch(src), self.sizes[size]))
+            except Exception:
+                self.app.logger.warning('Could not build a thumbnail for %s', src, exc_info=True)
+                # fall back to the original rather than a broken image
+                return redirect(src)
+        return send_file(path, mimetype='image/jpeg', max_age=7 * 24 * 60 * 60)
+
+    def render(self, data, size):
+        from PIL import Image
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail(size)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=85, optimize=True)
+        return out.getvalue()
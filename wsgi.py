@@ -0,0 +1,17 @@
+#----------------------------------------------------------------------------#
+# Production entry point.
+#
+#   SECRET_KEY=... DATABASE_URL=... gunicorn -c gunicorn.conf.py wsgi:app
+#
+# gunicorn.conf.py preloads this module in the master process and forks the
+# workers from it; see there for worker and thread counts.
+#----------------------------------------------------------------------------#
+
+import os
+
+os.environ.setdefault('DEBUG', '0')
+
+from app import app
+
+if not app.config.get('SECRET_KEY'):
+    raise RuntimeError('Set SECRET_KEY in the environment, every worker has to sign sessions with the same key.')